@@ -0,0 +1,301 @@
+#             Perforce Defect Tracking Integration Project
+#              <http://www.ravenbrook.com/project/p4dti/>
+#
+#       BENCHMARK.PY -- MEASURE THE PHASES OF GENERATING SCHEMA DOCUMENTS
+#
+#
+# 1. INTRODUCTION
+#
+# This module measures how long each phase of generating a schema
+# document takes, and how much memory it needs, for a few canonical
+# workloads, so that the effect of a change to the code can be shown,
+# and a change which makes things slower can be caught.  It is used by
+# 'schema-tool benchmark'.
+#
+# The results of a run can be saved as JSON, and later compared with
+# another run.  Timings depend on the machine, so only compare results
+# from the same machine.  The file 'benchmark_baseline.json' is a
+# baseline saved on the machine it names; peak memory doesn't depend
+# on the machine as much, so it is a guide to that, but record a new
+# baseline to compare timings.
+#
+# The intended readership is project developers.
+#
+# This document is not confidential.
+
+import collections
+import contextlib
+import json
+import platform
+import statistics
+import time
+import tracemalloc
+
+import get_schema
+import make_schema_doc
+import lazy_remarks as schema_remarks
+import schema_timeline
+
+# 2. Workloads and phases.
+#
+# A workload is a named range of versions: a single version, a pair of
+# adjacent versions, a major series, and the whole history.  For each,
+# these phases are measured:
+#
+# get_schema  reading and reducing each schema in the range, with the
+#             schema caches empty (see get_schema.py);
+#
+# and each of the phases of make_schema_doc.make_tables(), with the
+# timeline already loaded, as in a long-running server (see
+# make_schema_doc.phase_names); and 'total', the whole of
+# make_tables().
+#
+# The 'startup' workload measures the work done once by each process:
+# building the timeline from the schemas ('timeline_build') and
+# loading the saved timeline ('timeline_load').
+
+workloads = {
+    'single': ('5.2', '5.2'),
+    'adjacent': ('5.0.6', '5.2'),
+    'series': ('4.0', '4.4.14'),
+    'history': ('2.0', '5.9.1'),
+}
+
+workload_names = ['startup'] + list(workloads.keys())
+
+RESULTS_FORMAT = 1
+REPEAT = 5
+
+# A PhaseTimer is a make_schema_doc.PhaseTimer which, if 'memory' is
+# true, also records the most memory allocated during any run of each
+# phase (which needs tracemalloc to be tracing).
+#
+# Phases can be nested (the phases of make_tables() run inside
+# 'total'), and tracemalloc has only one peak, which is reset at the
+# start of each phase.  So 'stack' has a pair [base, peak] for each
+# phase which is running: the memory in use when it started, and the
+# highest peak seen while it was running up to the start of the phase
+# inside it.  When a phase ends, its peak is passed on to the phase
+# outside it.
+
+
+class PhaseTimer(make_schema_doc.PhaseTimer):
+    def __init__(self, memory=False):
+        super().__init__()
+        self.memory = memory
+        self.peaks = {}
+        self.stack = []
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        if self.memory:
+            (base, peak) = tracemalloc.get_traced_memory()
+            if self.stack:
+                self.stack[-1][1] = max(self.stack[-1][1], peak)
+            tracemalloc.reset_peak()
+            self.stack.append([base, base])
+        try:
+            with super().__call__(name):
+                yield
+        finally:
+            if self.memory:
+                (_, peak) = tracemalloc.get_traced_memory()
+                (base, inner_peak) = self.stack.pop()
+                peak = max(peak, inner_peak)
+                self.peaks[name] = max(self.peaks.get(name, 0), peak - base)
+                if self.stack:
+                    self.stack[-1][1] = max(self.stack[-1][1], peak)
+
+
+# 3. Running a workload.
+#
+# Each run of a workload returns a PhaseTimer.
+
+
+def schema_names(first, last):
+    names = []
+    for v in make_schema_doc.version_range(first, last):
+        name = schema_remarks.version_schema_map.get(v)
+        if name is not None and name not in names:
+            names.append(name)
+    return names
+
+
+def run_startup(timer):
+    get_schema.clear_cache()
+    key = schema_timeline.timeline_key()
+    with timer('timeline_build'):
+        timeline = schema_timeline.build_timeline(key)
+    schema_timeline.save_timeline(timeline)
+    with timer('timeline_load'):
+        schema_timeline.load_timeline(key)
+
+
+def run_workload(timer, first, last):
+    get_schema.clear_cache()
+    with timer('get_schema'):
+        for name in schema_names(first, last):
+            get_schema.get_schema(name, [])
+    schema_timeline.get_timeline()
+    ctx = make_schema_doc.RenderContext(timer)
+    with timer('total'):
+        make_schema_doc.make_tables(first, last, ctx=ctx)
+
+
+def run_once(name, memory=False):
+    timer = PhaseTimer(memory)
+    if name == 'startup':
+        run_startup(timer)
+    else:
+        (first, last) = workloads[name]
+        run_workload(timer, first, last)
+    return timer
+
+
+# Run the workloads, each 'repeat' times for the timings and once more
+# with tracemalloc for the memory, calling progress(name) before each.
+# Returns the results: for each workload and phase, the fastest time
+# ('seconds'), the median time ('median') and the peak memory
+# allocated ('peak_bytes').
+
+
+def run_benchmarks(names=None, repeat=REPEAT, progress=None):
+    if names is None:
+        names = workload_names
+    schema_timeline.get_timeline()
+    results = {
+        'format': RESULTS_FORMAT,
+        'created': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'repeat': repeat,
+        'remarks_id': make_schema_doc.strip_p4_id(schema_remarks.remarks_id),
+        'workloads': {},
+    }
+    for name in names:
+        if progress is not None:
+            progress(name)
+        timers = [run_once(name) for _ in range(repeat)]
+        tracemalloc.start()
+        try:
+            memory = run_once(name, memory=True)
+        finally:
+            tracemalloc.stop()
+        phases = {}
+        for phase in timers[0].seconds:
+            times = [t.seconds[phase] for t in timers]
+            phases[phase] = {
+                'seconds': min(times),
+                'median': statistics.median(times),
+                'peak_bytes': memory.peaks.get(phase, 0),
+            }
+        workload = {'phases': phases}
+        if name in workloads:
+            (workload['first'], workload['last']) = workloads[name]
+        results['workloads'][name] = workload
+    return results
+
+
+def save_results(results, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+def load_results(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        results = json.load(f)
+    if results.get('format') != RESULTS_FORMAT:
+        raise ValueError("%s is not a set of benchmark results." % path)
+    return results
+
+
+# 4. Comparing results.
+#
+# compare_results() compares two sets of results, phase by phase,
+# returning a list of Comparisons.  'seconds' and 'peak_bytes' are pairs
+# (base, current) of the fastest time and the peak memory.  A phase is
+# 'slower' if its fastest time is more than 'threshold' (as a fraction)
+# more than in the base results, and 'larger' if its peak memory is.
+# Small differences (less than NOISE_SECONDS or NOISE_BYTES) don't
+# count, as very short phases vary a lot from run to run.  Phases in
+# only one of the results are left out.
+
+THRESHOLD = 0.2
+NOISE_SECONDS = 0.001
+NOISE_BYTES = 64 * 1024
+
+Comparison = collections.namedtuple(
+    'Comparison', ['workload', 'phase', 'seconds', 'peak_bytes', 'slower', 'larger']
+)
+
+
+def worse(before, after, threshold, noise):
+    return after > before * (1 + threshold) and after - before > noise
+
+
+def compare_results(base, current, threshold=THRESHOLD):
+    comparisons = []
+    for (name, workload) in current['workloads'].items():
+        base_workload = base['workloads'].get(name)
+        if base_workload is None:
+            continue
+        for (phase, result) in workload['phases'].items():
+            base_result = base_workload['phases'].get(phase)
+            if base_result is None:
+                continue
+            seconds = (base_result['seconds'], result['seconds'])
+            peak = (base_result['peak_bytes'], result['peak_bytes'])
+            comparisons.append(
+                Comparison(
+                    name,
+                    phase,
+                    seconds,
+                    peak,
+                    worse(*seconds, threshold, NOISE_SECONDS),
+                    worse(*peak, threshold, NOISE_BYTES),
+                )
+            )
+    return comparisons
+
+
+# A. REFERENCES
+#
+#
+# B. DOCUMENT HISTORY
+#
+# 2026-10-18 AG  Created.
+#
+#
+# C. COPYRIGHT AND LICENSE
+#
+# This file is copyright (c) 2026 Bugzilla Project Contributors. All rights
+# reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# 1.  Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+# 2.  Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDERS AND CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+#
+# $Id$
@@ -8,21 +8,58 @@
 #
 # 1. INTRODUCTION
 #
-# This module decodes a Python pickle of a Bugzilla schema, and turns
-# it into a consistent data structure which incorporates remarks from
-# schema_remarks.py.  The pickles are originally put in the 'pickles'
-# subdirectory by pickle_schema.py.
+# This module decodes a Bugzilla schema, and turns it into a consistent
+# data structure which incorporates remarks from schema_remarks.py.
+# The schemas are read from the schema store (see schema_store.py) if
+# they are in it, and otherwise from the Python pickles originally put
+# in the 'pickles' subdirectory by pickle_schema.py.
 #
 # The intended readership is project developers.
 #
 # This document is not confidential.
 
+import collections
+import collections.abc
+import functools
+import os
 import pickle
+import sys
+import threading
 import types
-import schema_remarks
+import metrics
+import lazy_remarks as schema_remarks
+import schema_store
 import string
 import re
 
+# 2. The schema model.
+#
+# A reduced schema is a read-only map from table name to a Table, which
+# is a pair (columns, indexes).  'columns' is a read-only map from
+# column name to a Column, and 'indexes' is a read-only map from index
+# name to an Index.  Columns and indexes are named tuples, so they are
+# compact and can't be changed; the field names are the keys used in
+# the schema document ('Name', 'Type' and so on), so getattr() can be
+# used to look a field up by name.
+#
+# The same few type names, defaults and property strings occur
+# thousands of times across all the schemas, so the strings are
+# interned: every copy of a string is then the same object.
+#
+# Schemas are shared between all the documents generated by a process
+# (see get_schema() below), so nothing is allowed to modify them.
+
+Table = collections.namedtuple('Table', ['columns', 'indexes'])
+
+Column = collections.namedtuple(
+    'Column', ['Name', 'Default', 'Type', 'Properties', 'Remarks']
+)
+
+Index = collections.namedtuple('Index', ['Name', 'Fields', 'Properties', 'Remarks'])
+
+intern = sys.intern
+
+
 # 3. Obtaining a schema, and reducing it to a normal form.
 
 # This is a map from type names (as returned by a 'describe'
@@ -37,13 +74,13 @@ type_map = {
 }
 
 # Given output from a 'describe table' operation, return a map from
-# column name to a map with the following entries:
+# column name to a Column with the following fields:
 #
-# 'Name':       column name,
-# 'Default':    default value (or "None"),
-# 'Type':       type name,
-# 'Properties': properties (e.g. auto_increment).
-# 'Remarks'   : list of HTML remarks
+# Name:       column name,
+# Default:    default value (or "None"),
+# Type:       type name,
+# Properties: properties (e.g. auto_increment).
+# Remarks   : tuple of HTML remarks
 #
 # Because almost all columns are "NOT NULL", that is the default, and
 # other columns are marked 'null' under 'Properties'.
@@ -102,28 +139,28 @@ def reduce_columns(table, description, errors):
         else:
             remark = schema_remarks.column_remark[table][canonical_name]
         if remark is None:
-            remarks = []
+            remarks = ()
         elif type(remark) == list:
-            remarks = remark
+            remarks = tuple(remark)
         else:
-            remarks = [remark]
-        columns[canonical_name] = {
-            'Name': name,
-            'Default': default,
-            'Type': sqltype,
-            'Properties': extra,
-            'Remarks': remarks,
-        }
-    return columns
+            remarks = (remark,)
+        columns[canonical_name] = Column(
+            Name=intern(name),
+            Default=intern(default),
+            Type=intern(sqltype),
+            Properties=intern(extra),
+            Remarks=remarks,
+        )
+    return types.MappingProxyType(columns)
 
 
-# Given output from "show index", return a map from index name to a
-# map with the following entries:
+# Given output from "show index", return a map from index name to an
+# Index with the following fields:
 #
-# 'Name':    Index name, 'PRIMARY' for a primary index;
-# 'Fields':  A string containing the ordered column names;
-# 'Properties':  A string with such properties as 'unique' and 'full text'
-# 'Remarks': A list of remarks.
+# Name:    Index name, 'PRIMARY' for a primary index;
+# Fields:  A string containing the ordered column names;
+# Properties:  A string with such properties as 'unique' and 'full text'
+# Remarks: A tuple of remarks.
 
 foreign_key_index_re = re.compile('^fk_.*')
 
@@ -162,49 +199,231 @@ def reduce_indexes(table, index_list, errors):
             else:
                 remark = schema_remarks.index_remark[table][canon]
             if remark:
-                remarks = [remark]
+                remarks = (remark,)
             else:
-                remarks = []
+                remarks = ()
             indexes[canon] = {
                 'Name': kn,
                 'Fields': {i['Seq_in_index']: i['Column_name']},
                 'Properties': props,
                 'Remarks': remarks,
             }
-    # replace the 'Fields' map with an ordered list.
+    # replace the 'Fields' map with an ordered list, and make the Index.
     for k in list(indexes.keys()):
         f = list(indexes[k]['Fields'].items())
         f.sort()
-        indexes[k]['Fields'] = str.join(', ', list(map((lambda l: l[1]), f)))
-    return indexes
+        indexes[k] = Index(
+            Name=intern(indexes[k]['Name']),
+            Fields=intern(str.join(', ', list(map((lambda l: l[1]), f)))),
+            Properties=intern(indexes[k]['Properties']),
+            Remarks=indexes[k]['Remarks'],
+        )
+    return types.MappingProxyType(indexes)
 
 
 # Given a schema version name, get the schema for that database as a
-# map from table name to (columns, indexes), where columns is a map
-# produced by reduce_columns and indexes is a map produced by
-# reduce_indexes.
+# map from table name to Table (see section 2), with columns produced
+# by reduce_columns and indexes produced by reduce_indexes.
+#
+# Reduced schemas are cached, so that generating many documents in one
+# process (see the WSGI support in index.py) only reads and reduces each
+# schema once.  The cache is keyed by the modification time and size of
+# the file the schema is read from (the schema store or the pickle) as
+# well as the schema version, so a replaced file is read again.  The
+# errors found while reducing a schema are cached with it, and added to
+# 'errors' on every call.  The cached schemas are read-only, so every
+# caller gets the same object.
 
+SCHEMA_CACHE_SIZE = 64
 
-def get_schema(schema_version, errors):
-    f = None
+
+def pickle_path(schema_version):
+    return 'pickles/%s' % schema_version
+
+
+# Reduce a table, returning the pair (Table, errors).
+
+
+def reduce_table(table, columns, indexes):
+    errors = []
+    reduced = Table(
+        reduce_columns(table, columns, errors),
+        reduce_indexes(table, indexes, errors),
+    )
+    return (reduced, tuple(errors))
+
+
+# A table which is the same in several schemas is only stored once in
+# the schema store (see schema_store.py), so it is also only reduced
+# once, however many schemas it is looked up in.
+
+BLOCK_CACHE_SIZE = 1024
+
+
+@functools.lru_cache(maxsize=BLOCK_CACHE_SIZE)
+def reduce_block(store, table, block):
+    (columns, indexes) = store.table(block)
+    return reduce_table(table, columns, indexes)
+
+
+# A LazySchema is a read-only map from table name to Table, like a
+# reduced schema, except that each table is only decoded and reduced
+# when it is first looked up.  This is for documents which only show
+# some of the tables.  The errors found while reading the schema are in
+# 'errors', and the errors found while reducing a table are returned by
+# table_errors().  A schema which is not in the schema store has to be
+# unpickled all at once, but is still reduced a table at a time.
+
+
+class LazySchema(collections.abc.Mapping):
+    def __init__(self, schema_version, in_store):
+        self.store = None
+        self.raw = {}
+        self.reduced = {}
+        self.lock = threading.Lock()
+        errors = []
+        try:
+            if in_store:
+                self.store = schema_store.get_store()
+                self.raw = self.store.tables(schema_version)
+                schemas_read.inc('store')
+            else:
+                with open(pickle_path(schema_version), 'rb') as f:
+                    (sv, self.raw) = pickle.load(f)
+                schemas_read.inc('pickle')
+        except FileNotFoundError:
+            errors.append(
+                "Unable to locate schema data file for version %s" % (schema_version)
+            )
+        except Exception as e:
+            errors.append("%s: %s" % (type(e).__name__, str(e)))
+        self.names = list(self.raw.keys())
+        self.errors = tuple(errors)
+
+    # Return the pair (Table, errors) for a table, reducing it if this
+    # is the first time it has been asked for.
+    def reduce(self, table):
+        with self.lock:
+            if table not in self.reduced:
+                if self.store is not None:
+                    self.reduced[table] = reduce_block(
+                        self.store, table, self.raw[table]
+                    )
+                else:
+                    (columns, indexes) = self.raw.pop(table)
+                    self.reduced[table] = reduce_table(table, columns, indexes)
+            return self.reduced[table]
+
+    def table_errors(self, table):
+        return self.reduce(table)[1]
+
+    def __getitem__(self, table):
+        if table not in self.raw and table not in self.reduced:
+            raise KeyError(table)
+        return self.reduce(table)[0]
+
+    def __contains__(self, table):
+        return table in self.raw or table in self.reduced
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+
+@functools.lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def lazy_schema(schema_version, in_store, mtime, size):
+    return LazySchema(schema_version, in_store)
+
+
+@functools.lru_cache(maxsize=SCHEMA_CACHE_SIZE)
+def load_schema(schema_version, in_store, mtime, size):
+    lazy = lazy_schema(schema_version, in_store, mtime, size)
+    errors = list(lazy.errors)
     schema = {}
+    for table in lazy:
+        (schema[table], table_errors) = lazy.reduce(table)
+        errors.extend(table_errors)
+    return types.MappingProxyType(schema), tuple(errors)
+
+
+# The service's metrics (see metrics.py) include the number of schemas
+# read, from the schema store or from pickles, and the statistics of
+# the caches.
+
+schemas_read = metrics.counter(
+    'schemas_read', 'Schemas read, by where they were read from.', ['source']
+)
+metrics.cache('schema', load_schema)
+metrics.cache('lazy_schema', lazy_schema)
+metrics.cache('schema_table', reduce_block)
+
+
+# Forget all cached schemas.  Needed if schema_remarks is changed, as
+# the reduced schemas include remarks from it.
+
+
+def clear_cache():
+    load_schema.cache_clear()
+    lazy_schema.cache_clear()
+    reduce_block.cache_clear()
+
+
+# Return the key (in_store, mtime, size) under which a schema is
+# cached, or None if there is no such schema.
+
+
+def schema_key(schema_version):
+    store = schema_store.get_store()
+    if store is not None and store.has_schema(schema_version):
+        return (True,) + store.key
     try:
-        f = open('pickles/%s' % schema_version, 'rb')
-        (sv, schema) = pickle.load(f)
-        f.close()
-    except FileNotFoundError:
+        st = os.stat(pickle_path(schema_version))
+    except OSError:
+        return None
+    return (False, st.st_mtime_ns, st.st_size)
+
+
+def get_schema(schema_version, errors):
+    key = schema_key(schema_version)
+    if key is None:
         errors.append(
             "Unable to locate schema data file for version %s" % (schema_version)
         )
-    except Exception as e:
-        errors.append("%s: %s" % (type(e).__name__, str(e)))
-    tables = list(schema.keys())
-    for table in tables:
-        (columns, indexes) = schema[table]
-        schema[table] = (
-            reduce_columns(table, columns, errors),
-            reduce_indexes(table, indexes, errors),
+        return types.MappingProxyType({}), errors
+    (schema, schema_errors) = load_schema(schema_version, *key)
+    errors.extend(schema_errors)
+    return schema, errors
+
+
+# Given a schema version name, get the schema as a LazySchema.  Only
+# the errors found while reading the schema are added to 'errors'; the
+# caller should add the table_errors() of each table it uses.
+#
+# If 'count' is given, count('schemas_loaded') or
+# count('schemas_cached') is called, depending on whether the schema
+# had to be read.  (If several threads are reading schemas at once,
+# this may be wrong.)
+
+
+def get_lazy_schema(schema_version, errors, count=None):
+    key = schema_key(schema_version)
+    if key is None:
+        errors.append(
+            "Unable to locate schema data file for version %s" % (schema_version)
         )
+        return LazySchema(schema_version, False), errors
+    # pylint: disable-next=no-value-for-parameter
+    misses = lazy_schema.cache_info().misses
+    schema = lazy_schema(schema_version, *key)
+    if count is not None:
+        # pylint: disable-next=no-value-for-parameter
+        if lazy_schema.cache_info().misses > misses:
+            count('schemas_loaded')
+        else:
+            count('schemas_cached')
+    errors.extend(schema.errors)
     return schema, errors
 
 
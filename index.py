@@ -1,10 +1,18 @@
 import cgi
+import io
+import json
+import os
+import re
+import sys
 import time
 import html
 
 import make_schema_doc
 from make_schema_doc import BzSchemaProcessingException
-import schema_remarks
+import metrics
+import page_cache
+import lazy_remarks as schema_remarks
+import schema_diff
 
 # 1. GENERIC CGI SUPPORT FOR RAVENBROOK
 #
@@ -12,11 +20,12 @@ import schema_remarks
 #
 # Objects belonging to the webpage class output a web page when their
 # print_page() method is called.  Methods starting print_ actually print
-# to stdout whereas methods starting prepare_ only prepare some portion
-# of the output.  Subclasses of webpage should override the
-# prepare_body() method so that it constructs an appropriate body for
-# the web page (by making a series of calls to the b() method to
-# accumulate lines of body text).
+# to the page's output stream (stdout, unless the page is being served
+# through WSGI or ASGI; see section 7) whereas methods starting prepare_
+# only prepare some portion of the output.  Subclasses of webpage should
+# override the prepare_body() method so that it constructs an
+# appropriate body for the web page (by making a series of calls to the
+# b() method to accumulate lines of body text).
 #
 # The reason for constructing the whole body before printing anything is
 # so that errors can be handled simply gracefully.  A method that
@@ -28,7 +37,9 @@ import schema_remarks
 # the HTTP status header: for example (404, 'Not found') or (400,
 # 'Missing form parameter').  See [RFC 2616] for HTTP status codes.  The
 # status_message is also used to make the page's title.  The
-# error_message is used for the body of the page.
+# error_message is used for the body of the page, as HTML.  If it is not
+# plain text, the plain text can be given as a fourth argument, for
+# documents which aren't HTML.
 #
 # The script supports two behaviours for other errors:
 #
@@ -49,11 +60,12 @@ import schema_remarks
 
 
 class BzSchemaException(Exception):
-    def __init__(self, status, status_message, error_message):
+    def __init__(self, status, status_message, error_message, error_text=None):
         super().__init__(error_message)
         self.status = status
         self.status_message = status_message
         self.error_message = error_message
+        self.error_text = error_message if error_text is None else error_text
 
     def __str__(self):
         return self.error_message
@@ -66,9 +78,14 @@ class webpage:
     h1 = None  # Top-level header (if None, use title)
     status = 200  # HTTP status of output
     status_message = 'OK'  # Message to go with the status
+    error_message = None  # Message describing the error, if any
+    error_text = None  # The error message, as plain text
     title = 'Web page'  # Page title
     debug_messages = []  # no debug messages yet!
     debug_level = 0  # don't accumulate any debug messages
+    output = None  # Stream to print the page to
+    timer = None  # Time taken by each phase of making the page
+    ctx = None  # RenderContext for the schema document, if any
 
     def __init__(self):
         self.body = []
@@ -76,8 +93,17 @@ class webpage:
         self.debug_messages = []
         self.debug_level = 0
         self.directory_links = []
+        self.output = sys.stdout
+        self.timer = make_schema_doc.PhaseTimer()
+        self.ctx = make_schema_doc.RenderContext(self.timer)
 
-    # Append a line of HTML to the body of the webpage.
+    # Print to the output stream of the webpage.
+    def print(self, *args, end='\n'):
+        print(*args, end=end, file=self.output)
+
+    # Append a line of HTML to the body of the webpage.  Instead of a
+    # string, s can be an iterator over strings, which are only
+    # generated as the page is printed.
     def b(self, s):
         self.body.append(s)
 
@@ -100,8 +126,8 @@ class webpage:
     # in [RFC 822, 5.1] and modified by [RFC 1123, 5.2.14]; a date looks
     # like "Thu, 01 Dec 1994 16:00:00 GMT".
     def print_expires(self):
-        print('Expires:', end=' ')
-        print(
+        self.print('Expires:', end=' ')
+        self.print(
             time.strftime(
                 "%a, %d %b %Y 00:00:00 GMT", time.gmtime(time.time() + 60 * 60 * 24)
             )
@@ -116,66 +142,78 @@ class webpage:
     # Print the directory links that go at the top and bottom of the
     # page.
     def print_directory_links(self):
-        print('<p>')
+        self.print('<p>')
         url = ''
         separator = ''
         for dir, name in self.directory_links:
             url = url + dir + '/'
-            print('%s<a href="%s">%s</a>' % (separator, url, name))
+            self.print('%s<a href="%s">%s</a>' % (separator, url, name))
         separator = '/ '
-        print('</p>')
+        self.print('</p>')
+
+    # Return the HTTP headers for the page, as a list of (name, value)
+    # pairs.  The status is not included: see print_http_headers().
+    def http_headers(self):
+        return [('Content-Type', 'text/html')]
 
-    # Print the start of the webpage: the HTTP headers, the XML
-    # declaration, the XHTML document type, the HTML <head/> element,
-    # the directory links and the title.
+    # Print the CGI status line and the HTTP headers, followed by the
+    # blank line which separates them from the document.
+    def print_http_headers(self):
+        self.print('Status:', self.status, self.status_message)
+        for name, value in self.http_headers():
+            self.print('%s: %s' % (name, value))
+        self.print()
+
+    # Print the start of the webpage: the XML declaration, the XHTML
+    # document type, the HTML <head/> element, the directory links and
+    # the title.
     def print_header(self):
-        print('Status:', self.status, self.status_message)
-        print('Content-Type: text/html')
-        print()
-        print('<?xml version="1.0" encoding="UTF-8"?>')
-        print(
+        self.print('<?xml version="1.0" encoding="UTF-8"?>')
+        self.print(
             '<!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 '
             'Transitional//EN" "DTD/xhtml1-transitional.dtd">'
         )
-        print('<html xmlns="http://www.w3.org/1999/xhtml" ' 'xml:lang="en" lang="en">')
-        print('<head>')
-        print('<title>', html.escape(self.title), '</title>')
-        print('</head>')
-        print(
+        self.print(
+            '<html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">'
+        )
+        self.print('<head>')
+        self.print('<title>', html.escape(self.title), '</title>')
+        self.print('</head>')
+        self.print(
             '<body bgcolor="#FFFFFF" text="#000000" link="#000099" '
             'vlink="#660066" alink="#FF0000">'
         )
-        print(
+        self.print(
             '<a href="https://github.com/bugzilla/bugzilla-schema">'
             '<img style="position: absolute; top: 0; right: 0; border: 0;"'
             'src="https://s3.amazonaws.com/github/ribbons/forkme_right_red_aa0000.png"'
             'alt="Fork me on GitHub"></a>'
         )
-        print('<div align="center">')
+        self.print('<div align="center">')
         self.print_directory_links()
-        print('<hr />')
+        self.print('<hr />')
         if self.h1:
-            print('<h1>', self.h1, '</h1>')
+            self.print('<h1>', self.h1, '</h1>')
         else:
-            print('<h1>', html.escape(self.title), '</h1>')
-        print('</div>')
+            self.print('<h1>', html.escape(self.title), '</h1>')
+        self.print('</div>')
 
     # Print the coyright message and the license conditions.
     def print_copyright(self):
-        print(
+        self.print(
             '<p><small>This document is copyright &copy; 2001-2013 '
             'Perforce Software, Inc. &copy; 2024 Bugzilla '
             'Contributors.  All rights reserved.</small></p>\n'
         )
 
-        print(
+        self.print(
             '<p><small>Redistribution and use of this document in any form, '
             'with or without modification, is permitted provided that '
             'redistributions of this document retain the above copyright '
             'notice, this condition and the following disclaimer.</small></p>\n'
         )
 
-        print(
+        self.print(
             '<p><small><strong>This document is provided by the copyright '
             'holders and contributors "as is" and any express or implied '
             'warranties, including, but not limited to, the implied warranties '
@@ -200,15 +238,61 @@ class webpage:
     def print_debug(self):
         if self.debug_level > 0:
             if self.debug_messages:
-                print('<h3>Debugging Log:</h3>')
-                print('<small>')
+                self.print('<h3>Debugging Log:</h3>')
+                self.print('<small>')
                 for m in self.debug_messages:
-                    print(self.format_text(m))
-                    print('<br />')
-                print('</small>')
+                    self.print(html.escape(m))
+                    self.print('<br />')
+                self.print('</small>')
             else:
-                print('<h3>No Debugging Messages</h3>')
-            print('<hr />')
+                self.print('<h3>No Debugging Messages</h3>')
+            self.print_timings()
+            self.print('<hr />')
+
+    # Return a list of pairs (phase, seconds) giving the time taken so
+    # far by each phase of making the page, in order: checking the form
+    # ('check'), looking in the response cache ('cache'), and the phases
+    # of generating a schema document (see make_schema_doc.phase_names).
+    def timings(self):
+        seconds = self.timer.seconds
+        names = ['check', 'cache'] + make_schema_doc.phase_names
+        return [(name, seconds[name]) for name in names if name in seconds]
+
+    # Return a list of pairs (name, count) giving the work done so far
+    # in making the page: whether it was found in the response cache
+    # ('cache_hit'), and the counts for generating a schema document
+    # (see make_schema_doc.count_names).
+    def work_counts(self):
+        counts = self.ctx.counts
+        names = ['cache_hit'] + make_schema_doc.count_names
+        return [(name, counts[name]) for name in names if name in counts]
+
+    # Print the timings and counts as a table, for the debugging log.
+    def print_timings(self):
+        self.print('<h3>Timings:</h3>')
+        self.print('<table border="1" cellspacing="0" cellpadding="3">')
+        for (name, seconds) in self.timings():
+            self.print(
+                '<tr><td>%s</td><td align="right">%.2f ms</td></tr>'
+                % (name, seconds * 1000)
+            )
+        for (name, count) in self.work_counts():
+            self.print('<tr><td>%s</td><td align="right">%d</td></tr>' % (name, count))
+        self.print('</table>')
+
+    # Return the Server-Timing header [Server Timing] for the timings and
+    # counts so far, as a list of (name, value) pairs: durations are in
+    # milliseconds, and counts are given as descriptions.
+    def timing_headers(self):
+        metrics = [
+            '%s;dur=%.2f' % (name, seconds * 1000) for (name, seconds) in self.timings()
+        ]
+        metrics.extend(
+            '%s;desc=%d' % (name, count) for (name, count) in self.work_counts()
+        )
+        if not metrics:
+            return []
+        return [('Server-Timing', str.join(', ', metrics))]
 
     # Print the bottom of the webpage: the time the page was generated
     # (the is important because the contents may depend on the time the
@@ -216,51 +300,98 @@ class webpage:
     # will need to know when the contents apply), the script that
     # generated the page, directory links, and closing tags.
     def print_footer(self):
-        print('<hr />')
+        self.print('<hr />')
         self.print_debug()
         self.print_copyright()
-        print('<div align="center">')
+        self.print('<div align="center">')
         self.print_directory_links()
-        print('</div>')
-        print('</body>')
-        print('</html>')
-
-    # Print the page by calling the check_form_parameters and
-    # prepare_body methods, then printing the header, body and footer.
-    # If an error occurs in check_form_parameters or prepare_body, an
-    # error page is produced instead.
-    def print_page(self):
+        self.print('</div>')
+        self.print('</body>')
+        self.print('</html>')
+
+    # Call one of the methods which check or prepare the page.  If an
+    # error occurs, the page is turned into an error page instead, and
+    # False is returned.
+    def attempt(self, method):
         try:
-            self.check_debug_level()
-            self.check_form_parameters()
-            self.prepare_body()
+            method()
+            return True
         except BzSchemaException as e:
             self.status = e.status
             self.status_message = e.status_message
             error_message = e.error_message
-            self.title = self.status_message
-            self.h1 = self.title
-            self.body = ['<p>%s</p>' % error_message]
+            error_text = e.error_text
         except BzSchemaProcessingException as e:
             self.status = 500
             self.status_message = "Schema processing error"
             error_message = str(e)
-            self.title = self.status_message
-            self.h1 = self.title
-            self.body = ['<p>%s</p>' % error_message]
+            error_text = '\n'.join(e.errors)
         except Exception as e:
             error_type = type(e).__name__
             error_value = str(e)
             self.status = 500
             error_message = '%s: %s' % (error_type, error_value)
+            error_text = error_message
             self.status_message = 'Python error'
-            self.title = self.status_message
-            self.h1 = self.title
-            self.body = ['<p>%s</p>' % error_message]
-        self.print_header()
+        self.title = self.status_message
+        self.h1 = self.title
+        self.error_message = error_message
+        self.error_text = error_text
+        self.body = ['<p>%s</p>' % error_message]
+        return False
+
+    # Check the page by calling the check_debug_level and
+    # check_form_parameters methods, returning True if they succeed.
+    def check_page(self):
+        return self.attempt(self.check_debug_level) and self.attempt(
+            self.check_form_parameters
+        )
+
+    # Prepare the page by checking it and calling the prepare_body
+    # method.
+    def prepare_page(self):
+        if self.check_page():
+            self.attempt(self.prepare_body)
+
+    # Return a tuple of strings identifying the contents of the page, for
+    # the response cache (see section 7), or None if the page should not
+    # be cached.  Only called once the page has been checked.
+    def cache_key(self):
+        return None
+
+    # Print the document: the header, body and footer.
+    def print_document(self):
+        for chunk in self.document_chunks():
+            self.print(chunk, end='')
+
+    # Return the string printed by one of the print_ methods.
+    def capture(self, method):
+        output = self.output
+        self.output = io.StringIO()
+        try:
+            method()
+            return self.output.getvalue()
+        finally:
+            self.output = output
+
+    # Generate the document as a series of strings: the header, the
+    # lines of the body (generating any iterators in it as it goes), and
+    # the footer.
+    def document_chunks(self):
+        yield self.capture(self.print_header)
         for b in self.body:
-            print(b)
-        self.print_footer()
+            if isinstance(b, str):
+                yield b + '\n'
+            else:
+                yield from b
+                yield '\n'
+        yield self.capture(self.print_footer)
+
+    # Print the whole page, as a CGI response.
+    def print_page(self):
+        self.prepare_page()
+        self.print_http_headers()
+        self.print_document()
 
 
 # 2. SCHEMA WEBPAGE CLASS
@@ -268,7 +399,12 @@ class webpage:
 # This is a base class for all the schema webpage classes in section 3.
 
 
+table_name_re = re.compile('^[A-Za-z0-9_]+$')
+
+
 class schema_webpage(webpage):
+    cacheable = False  # Can the page be kept in the response cache?
+
     def __init__(self, form, action):
         # Call superclass method.
         webpage.__init__(self)
@@ -299,7 +435,7 @@ class schema_webpage(webpage):
             raise BzSchemaException(
                 400, 'Bad form parameters', 'No %s parameter.' % param
             )
-        if not version in schema_remarks.version_order:
+        if not make_schema_doc.is_version(version):
             raise BzSchemaException(
                 404,
                 'No such Bugzilla version',
@@ -312,9 +448,7 @@ class schema_webpage(webpage):
 
     def check_bugzilla_to(self):
         v = self.check_bugzilla_version('to')
-        if schema_remarks.version_order.index(v) >= schema_remarks.version_order.index(
-            self.from_version
-        ):
+        if make_schema_doc.version_compare(v, self.from_version) >= 0:
             self.to_version = v
         else:
             self.to_version = self.from_version
@@ -323,6 +457,57 @@ class schema_webpage(webpage):
     def check_bugzilla_single(self):
         self.version = self.check_bugzilla_version('version')
 
+    # Get the optional 'table' parameters, which restrict the document
+    # to some of the tables.  There may be several, and each may be a
+    # comma-separated list of table names.  self.tables is None if there
+    # are none.
+    def check_tables(self):
+        tables = []
+        if 'table' in self.form:
+            for value in self.form.getlist('table'):
+                tables.extend([t.strip() for t in value.split(',') if t.strip()])
+        for t in tables:
+            if not table_name_re.match(t):
+                message = 'Bad table name: %s.' % t
+                raise BzSchemaException(
+                    400, 'Bad form parameters', html.escape(message), message
+                )
+        self.log(8, "Tables: %s." % str.join(', ', tables))
+        self.tables = tables or None
+
+    def tables_key(self):
+        if self.tables is None:
+            return None
+        return str.join(',', self.tables)
+
+    # Return the part of the page title which says which tables are
+    # described.
+    def tables_title(self):
+        if self.tables is None:
+            return ''
+        elif len(self.tables) == 1:
+            return ': the "%s" table' % self.tables[0]
+        else:
+            return ': tables %s' % str.join(', ', self.tables)
+
+    # Return the number of Bugzilla versions the page describes, for the
+    # metrics (see section 8).
+    def version_count(self):
+        return 0
+
+    # Return a tuple of strings identifying the contents of the page,
+    # given the kind of page.  Subclasses of schema_webpage whose pages
+    # can be cached should set cacheable, and override this if their
+    # pages depend on the form parameters.
+    def page_key(self):
+        return ()
+
+    # Pages with a debugging log are not cached.
+    def cache_key(self):
+        if not self.cacheable or self.debug_level > 0:
+            return None
+        return (type(self).__name__,) + self.page_key()
+
     # Get and check the debugging level.
     def check_debug_level(self):
         level = self.param('debug')
@@ -346,9 +531,22 @@ class schema_webpage(webpage):
 
 
 class range_webpage(schema_webpage):
+    cacheable = True
+    from_version = None
+    to_version = None
+
     def check_form_parameters(self):
         self.check_bugzilla_from()
         self.check_bugzilla_to()
+        self.check_tables()
+
+    def page_key(self):
+        return (self.from_version, self.to_version, self.tables_key())
+
+    def version_count(self):
+        if self.to_version is None:
+            return 0
+        return len(make_schema_doc.version_range(self.from_version, self.to_version))
 
     def prepare_body(self):
         if self.from_version == self.to_version:
@@ -358,21 +556,45 @@ class range_webpage(schema_webpage):
                 self.from_version,
                 self.to_version,
             )
+        self.title += self.tables_title()
         self.h1 = self.title
-        self.b(make_schema_doc.make_body(self.from_version, self.to_version))
+        self.b(
+            make_schema_doc.stream_body(
+                self.from_version, self.to_version, self.tables, self.ctx
+            )
+        )
 
 
 class single_webpage(schema_webpage):
+    cacheable = True
+    version = None
+
     def check_form_parameters(self):
         self.check_bugzilla_single()
+        self.check_tables()
+
+    def page_key(self):
+        return (self.version, self.tables_key())
+
+    def version_count(self):
+        if self.version is None:
+            return 0
+        return 1
 
     def prepare_body(self):
         self.title = 'Bugzilla Schema for Version %s' % self.version
+        self.title += self.tables_title()
         self.h1 = self.title
-        self.b(make_schema_doc.make_body(self.version, self.version))
+        self.b(
+            make_schema_doc.stream_body(
+                self.version, self.version, self.tables, self.ctx
+            )
+        )
 
 
 class index_webpage(schema_webpage):
+    cacheable = True
+
     def prepare_body(self):
         # Page title.
         self.title = 'Bugzilla Schema Documentation'
@@ -433,17 +655,68 @@ class index_webpage(schema_webpage):
             self.b(l)
 
 
+# The metrics of this process (see section 8), in the Prometheus text
+# format, for a monitoring system to collect.  They say nothing about
+# the schemas, but a public server may want to keep them private by
+# refusing requests for "action=metrics" at the web server.
+
+
+class metrics_webpage(schema_webpage):
+    def http_headers(self):
+        if self.status != 200:
+            return super().http_headers()
+        return [('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')]
+
+    def document_chunks(self):
+        if self.status != 200:
+            yield from super().document_chunks()
+        else:
+            yield metrics.registry.text()
+
+
+# The differences between the schemas of two versions, as JSON (see
+# schema_diff.py), for programs which would otherwise have to read the
+# schema document for the range.  Errors are also reported as JSON.
+
+
+class diff_webpage(range_webpage):
+    diff = None  # Iterator over the JSON text of the diff
+
+    def http_headers(self):
+        return [('Content-Type', 'application/json; charset=utf-8')]
+
+    def prepare_body(self):
+        self.diff = schema_diff.diff_chunks(
+            self.from_version, self.to_version, self.tables, self.ctx
+        )
+
+    def document_chunks(self):
+        if self.status != 200:
+            error = {
+                'status': self.status,
+                'status_message': self.status_message,
+                'error': self.error_text,
+            }
+            yield json.dumps(error) + '\n'
+        else:
+            yield from self.diff
+
+
 # 6. OUTPUT THE PAGE
 
 action_class_map = {
     'single': single_webpage,
     'range': range_webpage,
     'index': index_webpage,
+    'metrics': metrics_webpage,
+    'diff': diff_webpage,
 }
 
 
-def show_page():
-    form = cgi.FieldStorage()
+# Choose the webpage class for a form, and make the page.
+
+
+def make_page(form):
     if 'action' in form:
         action = form['action'].value
     else:
@@ -452,11 +725,320 @@ def show_page():
         action_class = action_class_map[action]
     else:
         action_class = index_webpage
-    action_class(form, action).print_page()
+    return action_class(form, action)
+
+
+def show_page():
+    (status, headers, chunks) = render_page(cgi.FieldStorage(), os.environ)
+    sys.stdout.write('Status: %s\n' % status)
+    for name, value in headers:
+        sys.stdout.write('%s: %s\n' % (name, value))
+    sys.stdout.write('\n')
+    sys.stdout.flush()
+    for chunk in chunks:
+        sys.stdout.buffer.write(chunk)
+
+
+# 7. PERSISTENT SERVER SUPPORT
+#
+# Running as a CGI script means starting an interpreter and importing
+# make_schema_doc, get_schema and schema_remarks for every request,
+# which costs more than most renders.  The application() function is a
+# WSGI entry point, and asgi_application() is an ASGI one, so the
+# modules stay loaded in a long-lived worker process.  For example:
+#
+#   gunicorn --chdir /path/to/bugzilla-schema --threads 4 index:application
+#   uvicorn --app-dir /path/to/bugzilla-schema index:asgi_application
+#
+# The worker's current directory must be the directory containing
+# "pickles" (see get_schema.py).  The schema timeline (see
+# schema_timeline.py) is loaded by the first request for a long range
+# of versions, and kept for later ones.  Run "schema-tool timeline"
+# when deploying, as the service never builds or saves the timeline or
+# the remarks bundle (see lazy_remarks.py): without an up-to-date
+# timeline, long ranges are made by reading every schema in them.
+
+
+# Successful schema pages are kept in a response cache (see
+# page_cache.py), keyed by the page's cache_key() and a hash of the
+# files it depends on, and sent with ETag and Last-Modified headers.
+# A conditional request for a cached page which the client already has
+# is answered with "304 Not Modified" and no document.  The cache is in
+# memory, unless the BZ_SCHEMA_CACHE_DIR environment variable names a
+# directory to keep it in, which a CGI script needs, as its cache in
+# memory only lasts for one request.
+
+response_cache = page_cache.make_cache()
+
+
+# Prepare a page for a form, returning the WSGI status line, the list of
+# headers, and an iterable over the encoded document.  'environ' is the
+# CGI or WSGI environment, from which the conditional request headers
+# are taken.
+#
+# A page which can be cached but is not in the response cache is
+# generated in full, put in the cache, and sent with its ETag and
+# Last-Modified headers, so that even a CGI process, whose cache in
+# memory lasts for only one request, gives the client a validator to
+# make conditional requests with.  A page with a debugging log is also
+# generated in full before it is sent.  Any other page is streamed: it
+# is sent as it is generated.  All the errors in the schemas and
+# remarks are found before the body of a schema document is generated,
+# so they still make an error page.  A document which is all there is
+# sent as a list of one string, and any other as a generator.
+#
+# Every response has a Server-Timing header giving the time taken by
+# each phase of making the page, and counts of the work done (see
+# webpage.timing_headers()).  As the headers of a streamed page are
+# sent before its body is generated, they only cover the work done
+# before then.
+#
+# The request is counted in requests_in_progress until
+# record_request() is called: when the document is made, or when a
+# streamed document has been sent.  If an exception escapes before
+# then, the count is decremented here.
+
+
+def render_page(form, environ={}):
+    started = time.perf_counter()
+    requests_in_progress.inc()
+    handed_over = False
+    try:
+        page = make_page(form)
+        (status, headers, chunks) = page_response(page, environ)
+        handed_over = True
+        if isinstance(chunks, list):
+            record_request(page, status, started)
+        else:
+            chunks = metered_chunks(
+                chunks, lambda: record_request(page, status, started)
+            )
+    finally:
+        if not handed_over:
+            requests_in_progress.dec()
+    return (status, headers, chunks)
+
+
+def page_response(page, environ):
+    with page.timer('check'):
+        checked = page.check_page()
+    key = None
+    generated = time.time()
+    if checked and response_cache is not None:
+        key = page.cache_key()
+    if key is not None:
+        key = (page_cache.input_hash(),) + key
+        with page.timer('cache'):
+            entry = response_cache.get(key)
+        response_cache_lookups.inc('miss' if entry is None else 'hit')
+        if entry is not None:
+            page.ctx.count('cache_hit')
+            if page_cache.not_modified(
+                entry,
+                environ.get('HTTP_IF_NONE_MATCH'),
+                environ.get('HTTP_IF_MODIFIED_SINCE'),
+            ):
+                headers = page_cache.entry_headers(entry) + page.timing_headers()
+                return ('304 Not Modified', headers, [b''])
+            headers = (
+                entry.headers + page_cache.entry_headers(entry) + page.timing_headers()
+            )
+            return ('200 OK', headers, [entry.document])
+    if checked:
+        page.attempt(page.prepare_body)
+    status = '%d %s' % (page.status, page.status_message)
+    headers = page.http_headers()
+    chunks = encode_chunks(page.document_chunks())
+    if key is not None and page.status == 200:
+        document = b''.join(chunks)
+        entry = page_cache.make_entry(headers, document, generated)
+        response_cache.put(key, entry)
+        headers = headers + page_cache.entry_headers(entry)
+        if page_cache.not_modified(
+            entry,
+            environ.get('HTTP_IF_NONE_MATCH'),
+            environ.get('HTTP_IF_MODIFIED_SINCE'),
+        ):
+            return ('304 Not Modified', headers + page.timing_headers(), [b''])
+        return (status, headers + page.timing_headers(), [document])
+    if page.debug_level > 0:
+        chunks = [b''.join(chunks)]
+    return (status, headers + page.timing_headers(), chunks)
+
+
+def encode_chunks(chunks):
+    for chunk in chunks:
+        yield chunk.encode('utf-8')
+
+
+# A document which is in a list is all there, so the Content-Length
+# header can be sent.
+
+
+def application(environ, start_response):
+    form = cgi.FieldStorage(fp=environ['wsgi.input'], environ=environ)
+    (status, headers, chunks) = render_page(form, environ)
+    if isinstance(chunks, list) and not status.startswith('304'):
+        length = sum(len(chunk) for chunk in chunks)
+        headers = headers + [('Content-Length', str(length))]
+    start_response(status, headers)
+    return chunks
+
+
+async def asgi_application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+    request_body = b''
+    more_body = True
+    while more_body:
+        message = await receive()
+        request_body += message.get('body', b'')
+        more_body = message.get('more_body', False)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'CONTENT_LENGTH': str(len(request_body)),
+    }
+    for name, value in scope['headers']:
+        name = name.decode('latin-1')
+        if name == 'content-type':
+            environ['CONTENT_TYPE'] = value.decode('latin-1')
+        else:
+            environ['HTTP_' + name.upper().replace('-', '_')] = value.decode('latin-1')
+    form = cgi.FieldStorage(fp=io.BytesIO(request_body), environ=environ)
+    # imported here, as importing asyncio takes longer than most CGI
+    # requests, and only ASGI needs it
+    import asyncio  # pylint: disable=import-outside-toplevel
+
+    loop = asyncio.get_running_loop()
+    (status, headers, chunks) = await loop.run_in_executor(
+        None, render_page, form, environ
+    )
+    if isinstance(chunks, list) and not status.startswith('304'):
+        length = sum(len(chunk) for chunk in chunks)
+        headers = headers + [('Content-Length', str(length))]
+    await send(
+        {
+            'type': 'http.response.start',
+            'status': int(status.split(' ', 1)[0]),
+            'headers': [
+                (name.lower().encode('latin-1'), value.encode('latin-1'))
+                for name, value in headers
+            ],
+        }
+    )
+    # Generate the chunks in a worker thread, so that other requests
+    # are served meanwhile.
+    chunk_iterator = iter(chunks)
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunk_iterator, None)
+            if chunk is None:
+                break
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        if hasattr(chunks, 'close'):
+            chunks.close()
+
+
+# 8. METRICS
+#
+# The metrics of this process (see metrics.py) include, for each
+# request, the action and the HTTP status, the time taken to make and
+# send the page (split by the action and the number of versions the
+# page describes), the number of schemas which had to be read for it,
+# and whether it was found in the response cache; and the number of
+# pages being made or sent at the moment.
+
+requests = metrics.counter(
+    'requests', 'Requests, by action and HTTP status.', ['action', 'status']
+)
+request_seconds = metrics.histogram(
+    'request_seconds',
+    'Time to make and send a page, by action and number of versions.',
+    ['action', 'versions'],
+)
+requests_in_progress = metrics.gauge(
+    'requests_in_progress', 'Pages being made or sent.'
+)
+schemas_loaded = metrics.histogram(
+    'request_schemas_loaded',
+    'Schemas read for one page.',
+    buckets=(0, 1, 2, 5, 10, 20, 50, 100),
+)
+response_cache_lookups = metrics.counter(
+    'response_cache_lookups', 'Lookups in the response cache, by result.', ['result']
+)
+
+
+# The number of versions is split into a few ranges, so that there are
+# not too many histograms: a pair (n, label) means that the label is
+# used for up to n versions.
+
+version_count_labels = [(0, 'none'), (1, '1'), (2, '2'), (10, '3-10'), (50, '11-50')]
+
+
+def version_count_label(n):
+    for (limit, label) in version_count_labels:
+        if n <= limit:
+            return label
+    return '51+'
+
+
+def record_request(page, status, started):
+    try:
+        action = page.action if page.action in action_class_map else 'index'
+        requests.inc(action, status.split(' ', 1)[0])
+        request_seconds.observe(
+            time.perf_counter() - started,
+            action,
+            version_count_label(page.version_count()),
+        )
+        schemas_loaded.observe(page.ctx.counts.get('schemas_loaded', 0))
+    finally:
+        requests_in_progress.dec()
+
+
+# Pass on the chunks of a document, and call done() when they have all
+# been passed on or the iteration is stopped, whichever is first.
+# This has a close() method, so WSGI servers call it even if the client
+# goes away part way through the document [PEP 3333].
+
+
+class metered_chunks:
+    def __init__(self, chunks, done):
+        self.chunks = chunks
+        self.done = done
+
+    def __iter__(self):
+        try:
+            yield from self.chunks
+        finally:
+            self.close()
+
+    def close(self):
+        if self.done is not None:
+            (done, self.done) = (self.done, None)
+            done()
 
 
 # A. REFERENCES
 #
+# [PEP 3333] "Python Web Server Gateway Interface v1.0.1"; P. J. Eby;
+# <https://peps.python.org/pep-3333/>.
+#
+# [Server Timing] "Server Timing"; W3C;
+# <https://www.w3.org/TR/server-timing/>.
+#
 #
 # B. DOCUMENT HISTORY
 #
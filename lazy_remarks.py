@@ -0,0 +1,261 @@
+#             Perforce Defect Tracking Integration Project
+#              <http://www.ravenbrook.com/project/p4dti/>
+#
+#            LAZY_REMARKS.PY -- SCHEMA REMARKS, LOADED WHEN NEEDED
+#
+#
+# 1. INTRODUCTION
+#
+# schema_remarks.py defines all the remarks and running text used in
+# the schema documents.  It is several thousand lines long, and
+# compiling it takes longer than generating some documents.  A CGI
+# script imports everything for every request, and if the web server
+# can't write the compiled bytecode next to the code, it compiles
+# schema_remarks.py every time.  (With the bytecode, importing it only
+# takes a couple of milliseconds, and this module saves little.)
+#
+# This module has the same variables as schema_remarks, but only loads
+# them when they are first used, a section at a time (see section 2),
+# from a bundle made from schema_remarks.py: the file
+# "schema_remarks.bin", in which each section is stored separately
+# using marshal [Python].  So the index page only loads the list of
+# versions, and the prose of the prelude and afterword is only loaded
+# when a document is generated.  The modules which generate documents
+# import this module as schema_remarks.
+#
+# The bundle is only made by schema-tool (see write_bundle()), never
+# by the web interface, which doesn't write files next to the code.  It
+# is committed along with schema_remarks.py, and identifies it by its
+# contents, not its modification time, so that it is still up to date
+# when checked out.  If the bundle is missing, or was made from a
+# different schema_remarks.py, this module imports schema_remarks and
+# uses its variables instead, which is slower but gives the same
+# documents.  If schema_remarks has already been imported in this
+# process (as it is by schema-tool, which changes the remarks), its
+# variables are used instead of the bundle, so that the changes are
+# seen.
+#
+# The intended readership is project developers.
+#
+# This document is not confidential.
+
+import hashlib
+import importlib
+import marshal
+import os
+import sys
+import tempfile
+import threading
+
+# 2. Sections.
+#
+# The variables of schema_remarks, in the sections in which they are
+# loaded.
+
+sections = {
+    'versions': [
+        'version_order',
+        'default_first_version',
+        'default_last_version',
+        'version_schema_map',
+        'remarks_id',
+    ],
+    'tables': ['table_remark', 'table_added_remark', 'table_removed_remark'],
+    'columns': [
+        'column_remark',
+        'column_renamed',
+        'column_added_remark',
+        'column_removed_remark',
+    ],
+    'indexes': [
+        'index_remark',
+        'index_renamed',
+        'index_added_remark',
+        'index_removed_remark',
+    ],
+    'text': [
+        'version_remark',
+        'notation_guide',
+        'header',
+        'footer',
+        'prelude',
+        'afterword',
+    ],
+}
+
+section_of = {name: section for (section, names) in sections.items() for name in names}
+
+
+# 3. Making the bundle.
+#
+# The bundle is a marshalled pair (key, sections), where 'key' is the
+# SHA-256 digest of schema_remarks.py, and 'sections' maps the name of
+# each section to its variables, as a marshalled map from name to
+# value.
+
+# Increase this when the sections or the structure of the bundle
+# change.
+BUNDLE_FORMAT = 2
+BUNDLE_FILE = 'schema_remarks.bin'
+
+
+def source_path():
+    here = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(here, 'schema_remarks.py')
+
+
+def bundle_path():
+    return os.path.join(os.path.dirname(source_path()), BUNDLE_FILE)
+
+
+def bundle_key():
+    with open(source_path(), 'rb') as f:
+        return (BUNDLE_FORMAT, hashlib.sha256(f.read()).hexdigest())
+
+
+# The bundle is made from schema_remarks.py as it is on disk, run as a
+# module of its own, so that it matches its key even if schema_remarks
+# has been imported and changed in this process.
+
+
+def make_bundle(key):
+    # imported here, as only schema-tool makes the bundle
+    import importlib.util  # pylint: disable=import-outside-toplevel
+
+    spec = importlib.util.spec_from_file_location('schema_remarks', source_path())
+    remarks = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(remarks)
+    bundle = {}
+    for (section, names) in sections.items():
+        values = {name: getattr(remarks, name) for name in names}
+        bundle[section] = marshal.dumps(values)
+    return (key, bundle)
+
+
+# Load the bundle, returning None if it is missing or out of date.
+
+
+def load_bundle(key):
+    try:
+        with open(bundle_path(), 'rb') as f:
+            loaded = marshal.loads(f.read())
+    except Exception:
+        return None
+    if not isinstance(loaded, tuple) or loaded[0] != key:
+        return None
+    return loaded
+
+
+# Save the bundle.  As with the schema timeline (see
+# schema_timeline.py), the file is replaced atomically.
+
+
+def save_bundle(bundle):
+    path = bundle_path()
+    (fd, temp) = tempfile.mkstemp(dir=os.path.dirname(path), prefix=BUNDLE_FILE)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump(bundle, f)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+# Make and save the bundle, if it is missing or out of date.  Used by
+# schema-tool.  Returns True if the bundle was saved.
+
+
+def write_bundle():
+    key = bundle_key()
+    if load_bundle(key) is not None:
+        return False
+    save_bundle(make_bundle(key))
+    return True
+
+
+# 4. Loading the variables.
+#
+# The whole bundle is read the first time any section is needed, so
+# all the sections come from the same version of schema_remarks.py.
+# The variables of a section are put in the globals of this module when
+# it is loaded, so __getattr__() [PEP 562] is only called for the
+# first use of each section.  load_section() returns None if there is
+# no usable bundle ('bundle' is then False), and schema_remarks is
+# imported instead.
+
+bundle = None
+bundle_lock = threading.Lock()
+
+
+def load_section(section):
+    global bundle
+    with bundle_lock:
+        if bundle is None:
+            bundle = load_bundle(bundle_key()) or False
+        if not bundle:
+            return None
+        values = marshal.loads(bundle[1][section])
+        globals().update(values)
+        return values
+
+
+def __getattr__(name):
+    if name not in section_of:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    remarks = sys.modules.get('schema_remarks')
+    if remarks is None:
+        values = load_section(section_of[name])
+        if values is not None:
+            return values[name]
+        remarks = importlib.import_module('schema_remarks')
+    return getattr(remarks, name)
+
+
+# A. REFERENCES
+#
+# [PEP 562] "Module __getattr__ and __dir__"; I. Levkivskyi;
+# <https://peps.python.org/pep-0562/>.
+#
+# [Python] "marshal -- Internal Python object serialization"; Python
+# Software Foundation; <https://docs.python.org/3/library/marshal.html>.
+#
+#
+# B. DOCUMENT HISTORY
+#
+# 2026-10-18 AG  Created.
+#
+#
+# C. COPYRIGHT AND LICENSE
+#
+# This file is copyright (c) 2026 Bugzilla Project Contributors. All rights
+# reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# 1.  Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+# 2.  Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDERS AND CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+#
+# $Id$
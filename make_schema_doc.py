@@ -16,11 +16,16 @@
 #
 # This document is not confidential.
 
+import contextlib
+import functools
 import re
 import time
+import types
 
-import schema_remarks
+import metrics
+import lazy_remarks as schema_remarks
 import get_schema
+import schema_timeline
 
 
 class BzSchemaProcessingException(Exception):
@@ -34,28 +39,195 @@ class BzSchemaProcessingException(Exception):
         return '\n' + self.message
 
 
-errors = []
+# A RenderContext holds the state of one schema document while it is
+# being generated: the list of errors found in the schemas and remarks,
+# the dictionary used to format remarks, the list of HTML strings
+# making up the body of the document, and the inputs the document
+# depends on.  Each call to make_tables() has its own context, so
+# several documents can be generated at once in one process.
+#
+# An input is a pair (name, key).  If name is 'schema', key is the
+# name of a schema (see get_schema.py).  Otherwise name is the name of
+# a variable in schema_remarks, and key is None for the whole of it or
+# an entry in it; or name is 'keys:' followed by the name of a map in
+# schema_remarks, and the input is just its keys (and the keys of any
+# maps in it).  The site builder (see site_builder.py) uses
+# the inputs to decide which documents have to be generated again.
+#
+# A context may also have a timer, which is told about each phase of
+# generating the document (see phase_names): timer(name) returns a
+# context manager which is entered while that phase runs.  A phase may
+# run several times for one document (the body is generated a table at
+# a time), so the timer should add up the times for each name, as a
+# PhaseTimer does.  The benchmarks (see benchmark.py) and the debugging
+# log and Server-Timing header of the web pages (see index.py) use
+# this.
+#
+# A context also counts some of the work done for the document (see
+# count_names), in 'counts'.
+
+
+class RenderContext:
+    def __init__(self, timer=None):
+        self.errors = []
+        self.dict = {}
+        self.body = []
+        self.inputs = {}
+        self.timer = timer
+        self.counts = {}
+
+    def add(self, s):
+        self.body.append(s)
+
+    def use(self, name, key=None):
+        self.inputs[(name, key)] = True
+
+    def phase(self, name):
+        if self.timer is None:
+            return contextlib.nullcontext()
+        return self.timer(name)
+
+    def count(self, name, n=1):
+        self.counts[name] = self.counts.get(name, 0) + n
+
+
+# A PhaseTimer adds up the time spent in each phase, in seconds, in
+# 'seconds'.
+
+
+class PhaseTimer:
+    def __init__(self):
+        self.seconds = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = (
+                self.seconds.get(name, 0.0) + time.perf_counter() - start
+            )
+
+
+# The phases of generating a document, in order.
+#
+# timeline          getting the schema timeline (see schema_timeline.py)
+# versioned_tables  slicing the versioned schema out of it, or reading
+#                   the schemas
+# annotate          colouring it and adding remarks for the changes
+# stringify         turning the fields of columns and indexes into text
+# output_dict       making the dictionary for formatting remarks
+# table_remarks     formatting the table remarks and the table of tables
+# header            formatting the header and footer
+# remarks           formatting the remarks of every column and index
+# body              generating the body: the prelude, the description of
+#                   each table, and the afterword
+# diff              comparing the versioned schema, for a schema diff
+#                   instead of a document (see schema_diff.py)
+
+phase_names = [
+    'timeline',
+    'versioned_tables',
+    'annotate',
+    'stringify',
+    'output_dict',
+    'table_remarks',
+    'header',
+    'remarks',
+    'body',
+    'diff',
+]
+
+
+# The counts of the work done for a document.
+#
+# timeline_cached  the schema timeline was already in memory
+# timeline_loaded  the saved schema timeline was loaded
+# timeline_built   the schema timeline was built from the schemas
+# schemas_cached   schemas which were already in memory
+# schemas_loaded   schemas read from the schema store or a pickle
+# schemas          schemas in the versioned schema
+# tables           tables in the body of the document
+# columns          columns in those tables
+# indexes          indexes in those tables
+# characters       characters in the body of the document
+
+count_names = [
+    'timeline_cached',
+    'timeline_loaded',
+    'timeline_built',
+    'schemas_cached',
+    'schemas_loaded',
+    'schemas',
+    'tables',
+    'columns',
+    'indexes',
+    'characters',
+]
+
+# The service's metrics (see metrics.py) include the number of
+# versioned schemas made, of all the tables or of only some.
+
+versioned_schemas = metrics.counter(
+    'versioned_schemas', 'Versioned schemas made, of all tables or some.', ['tables']
+)
+
+
+# The variables in schema_remarks which have an entry for each table.
+
+table_remark_names = [
+    'table_remark',
+    'table_added_remark',
+    'table_removed_remark',
+    'column_remark',
+    'column_renamed',
+    'column_added_remark',
+    'column_removed_remark',
+    'index_remark',
+    'index_renamed',
+    'index_added_remark',
+    'index_removed_remark',
+]
+
+
+# Bugzilla versions are ordered by their position in
+# schema_remarks.version_order.  version_rank maps each version to its
+# position, so that versions can be compared without searching the
+# list.  All version comparisons should go through the functions
+# below.
+
+version_rank = {v: i for (i, v) in enumerate(schema_remarks.version_order)}
+
+
+def is_version(v):
+    return v in version_rank
 
 
 def version_compare(v1, v2):
     # we already have the order defined in a table, let's use it
     # this also lets us make 5.1 be > 5.2 (which is actually true)
-    v1idx = schema_remarks.version_order.index(v1)
-    v2idx = schema_remarks.version_order.index(v2)
+    v1idx = version_rank[v1]
+    v2idx = version_rank[v2]
     return (v1idx > v2idx) - (v1idx < v2idx)
 
 
-vd_cache = {}
+# Return the list of versions from first to last inclusive.
+
+
+def version_range(first, last):
+    return schema_remarks.version_order[version_rank[first] : version_rank[last] + 1]
+
 
 # versioning_dict takes two bugzilla versions, first and last, and the
 # list of the bugzilla_versions for which we are generating the schema
 # doc.  It returns either None (if none of the versions are included
-# in the range from first to last inclusive) or a dictionary with two
-# keys, VERSION_COLOUR and VERSION_STRING, for use in formatting a
-# part of the schema documentation which is only true from 'first' to
-# 'last'.  'first' can be None (meaning since before time began).
-# 'last' can be None (meaning until the end of time).  Possible
-# outcomes:
+# in the range from first to last inclusive) or a read-only dictionary
+# with two keys, VERSION_COLOUR and VERSION_STRING, for use in
+# formatting a part of the schema documentation which is only true
+# from 'first' to 'last'.  'first' can be None (meaning since before
+# time began).  'last' can be None (meaning until the end of time).
+# Possible outcomes:
 #
 # V_C     V_S                           state
 #
@@ -65,27 +237,48 @@ vd_cache = {}
 # red     Up to and including <last>    no versions before first
 # red     In version <only>             first = last
 # red     From <first> to <last>        first < last
+#
+# The list of versions is always a range of consecutive versions (see
+# version_range()), so the result only depends on the ranks of first,
+# last and the ends of the range.  Results are cached by those ranks,
+# in a cache of bounded size, so a long-running server doesn't
+# accumulate a cache entry for every range it is asked for.
+# rank_versioning_dict.cache_info() reports the hits and misses, as do
+# the service's metrics (see metrics.py).
+
+VERSIONING_CACHE_SIZE = 4096
 
 
 def versioning_dict(first, last, versions):
-    if versions not in vd_cache:
-        vd_cache[versions] = {}
-    if (first, last) in vd_cache[versions]:
-        return vd_cache[versions][(first, last)]
-    dict = {}
-    before_first = False  # any versions before first?
-    inside = False  # any versions in the range?
+    return rank_versioning_dict(
+        version_rank[first] if first else None,
+        version_rank[last] if last else None,
+        version_rank[versions[0]],
+        version_rank[versions[-1]],
+    )
+
+
+@functools.lru_cache(maxsize=VERSIONING_CACHE_SIZE)
+def rank_versioning_dict(first_rank, last_rank, start, end):
+    # the versions from 'low' to 'end' are not before first
+    if first_rank is None:
+        low = start
+    else:
+        low = max(start, first_rank)
+    before_first = low > start  # any versions before first?
+    inside = low <= end  # any versions in the range?
     after_last = False  # any versions after last?
-    for v in versions:
-        if first and version_compare(first, v) > 0:
-            before_first = True  # this version is before the first
-        elif last and version_compare(last, v) < 0:
-            after_last = True  # this version is after the last
-        elif not last or version_compare(last, v) >= 0:
-            inside = True  # this version is inside the range
+    if last_rank is not None:
+        inside = inside and low <= last_rank
+        after_last = low <= end and last_rank < end
     if not inside:
-        vd_cache[versions][(first, last)] = None
-        return
+        return None
+    first = last = None
+    if first_rank is not None:
+        first = schema_remarks.version_order[first_rank]
+    if last_rank is not None:
+        last = schema_remarks.version_order[last_rank]
+    dict = {}
     outside = before_first or after_last
     if not outside:
         dict['VERSION_COLOUR'] = ''
@@ -102,8 +295,10 @@ def versioning_dict(first, last, versions):
     elif not before_first and after_last:
         dict['VERSION_COLOUR'] = red
         dict['VERSION_STRING'] = '<b>Up to and including %s:</b> ' % last
-    vd_cache[versions][(first, last)] = dict
-    return dict
+    return types.MappingProxyType(dict)
+
+
+metrics.cache('versioning_dict', rank_versioning_dict)
 
 
 # Parts of the schema description only apply to particular ranges of
@@ -123,55 +318,97 @@ def versioning_dict(first, last, versions):
 # elements. These elements include VERSION_STRING (see above) and
 # VERSION_COLOUR.
 #
+# Only two format specifications are allowed in the strings: %(NAME)s
+# and %%.  Rather than formatting each string with the % operator every
+# time it is used, compile_template() parses it once into a tuple of
+# (literal, name) pairs, in which the name of the last pair is None, and
+# keeps the result for the life of the process.  render() substitutes
+# values from the dictionary into a compiled string, taking
+# VERSION_STRING and VERSION_COLOUR from the versioning dictionary 'vd'
+# if there is one.  The dictionary is never changed, so it can be
+# shared by everything which formats remarks for one document.
+#
 # process() takes a schema remark and a list of bugzilla versions and
 # returns the concatenated processed string
 
+template_re = re.compile(r'%(?:\(([^)]*)\)s|%)')
+
+compiled_templates = {}
+
+
+def compile_template(text):
+    template = compiled_templates.get(text)
+    if template is not None:
+        return template
+    pairs = []
+    literal = []
+    pos = 0
+    for m in template_re.finditer(text):
+        literal.append(text[pos : m.start()])
+        pos = m.end()
+        if m.group(1) is None:
+            literal.append('%')
+        else:
+            pairs.append((str.join('', literal), m.group(1)))
+            literal = []
+    literal.append(text[pos:])
+    pairs.append((str.join('', literal), None))
+    if '%' in template_re.sub('', text):
+        raise ValueError("Unsupported format specification in remark %r." % text)
+    template = tuple(pairs)
+    compiled_templates[text] = template
+    return template
+
+
+def render(text, dict, vd=None):
+    parts = []
+    for (literal, name) in compile_template(text):
+        parts.append(literal)
+        if name is not None:
+            if vd is not None and name in vd:
+                parts.append(str(vd[name]))
+            else:
+                parts.append(str(dict[name]))
+    return str.join('', parts)
+
 
 def process(x, bugzilla_versions, dict):
-    if type(x) == bytes or type(x) == str:
-        return x % dict
+    if type(x) == str:
+        return render(x, dict)
     elif type(x) == list:
-        return str.join(
-            '', list(map(lambda i, bv=bugzilla_versions, d=dict: process(i, bv, d), x))
-        )
+        return str.join('', [process(i, bugzilla_versions, dict) for i in x])
     else:
         (first, last, text) = x
         vd = versioning_dict(first, last, bugzilla_versions)
         if vd:
-            dict.update(vd)
-            return text % dict
+            return render(text, dict, vd)
         else:
             return ''
 
 
 # 5. Generating HTML
 
-body = []
-
-
-def add(s):
-    body.append(s)
-
-
 # output a coloured anchored table row, with a <th> in the first
-# column.
+# column.  'record' is a Column or Index (see get_schema.py).
 
 
-def output_row(anchor, name, dict, keys, colours):
+def output_row(ctx, anchor, name, record, keys, colours):
+    add = ctx.add
     add('  <tr%s valign="top" align="left">\n\n' % colours[''])
     add(
         '    <th%s><a id="%s" name="%s">%s</a></th>\n\n'
-        % (colours['Name'], anchor, anchor, dict['Name'])
+        % (colours['Name'], anchor, anchor, record.Name)
     )
     for k in keys:
-        add('    <td%s>%s</td>\n\n' % (colours[k], dict[k]))
+        add('    <td%s>%s</td>\n\n' % (colours[k], getattr(record, k)))
     add('  </tr>\n\n')
 
 
 # output the main schema table for a table.
 
 
-def output_description(table, colour, remark, columns, colours, dict, bv):
+def output_description(ctx, table, colour, remark, columns, colours):
+    add = ctx.add
     if remark:
         add('<p>%s</p>\n\n' % remark)
     add('<table%s border="1" cellspacing="0" cellpadding="5">\n\n' % colour)
@@ -186,15 +423,11 @@ def output_description(table, colour, remark, columns, colours, dict, bv):
     cs = list(columns.keys())
     cs.sort()
     for c in cs:
-        d = columns[c]
-        if d['Remarks']:
-            d['Remarks'] = str.join(' ', [process(r, bv, dict) for r in d['Remarks']])
-        else:
-            d['Remarks'] = '-'
         output_row(
+            ctx,
             'column-%s-%s' % (table, c),
             c,
-            d,
+            columns[c],
             ['Type', 'Default', 'Properties', 'Remarks'],
             colours[c],
         )
@@ -204,7 +437,8 @@ def output_description(table, colour, remark, columns, colours, dict, bv):
 # output the indexes table for a table
 
 
-def output_indexes(table, colour, indexes, colours, dict, bv):
+def output_indexes(ctx, table, colour, indexes, colours):
+    add = ctx.add
     add('<table%s border="1" cellspacing="0" cellpadding="5">\n\n' % colour)
     # order the indexes: PRIMARY first, then alphabetical.
     inames = list(indexes.keys())
@@ -219,99 +453,134 @@ def output_indexes(table, colour, indexes, colours, dict, bv):
     add('    <th>Remarks</th>\n\n')
     add('  </tr>\n\n')
     for iname in inames:
-        l = indexes[iname]
-        if l['Remarks']:
-            l['Remarks'] = str.join(
-                ' ', list(map(lambda r, bv=bv, d=dict: process(r, bv, d), l['Remarks']))
-            )
-        else:
-            l['Remarks'] = '-'
         output_row(
+            ctx,
             "index-%s-%s" % (table, iname),
             iname,
-            l,
+            indexes[iname],
             ['Fields', 'Properties', 'Remarks'],
             colours[iname],
         )
     add('</table>\n\n')
 
 
-def make_output_dict(schema, bugzilla_versions):
-    dict = {}
+# The dictionary for formatting remarks (see process()) has an entry
+# for each possible cross-reference in the remarks:
+#
+#   the-table-T     "the T table", linked to table T
+#   table-T         "T", linked to table T
+#   column-T-C      "T.C", linked to column C of table T
+#   index-T-I       "T:I", linked to index I of table T
+#
+# There are thousands of these, and a document only uses a few hundred,
+# so a LinkDict makes each entry when it is first looked up.  A
+# reference to a table, column or index which is not in the document
+# but has remarks is plain text rather than a link, so remarks which
+# only apply to some versions can still refer to it.  A renamed column
+# or index (see column_renamed and index_renamed) is a link to its
+# canonical name, unless that is not in the document, or its old name
+# is in the document too.
+
+
+class LinkDict(dict):
+    def __init__(self, schema):
+        super().__init__()
+        self.schema = schema
+
+    def __missing__(self, key):
+        value = self.link(key)
+        if value is None:
+            raise KeyError(key)
+        self[key] = value
+        return value
+
+    def link(self, key):
+        (kind, _, rest) = key.partition('-')
+        if kind == 'the' and rest.startswith('table-'):
+            t = rest[len('table-') :]
+            if t in self.schema:
+                return 'the <a href="#table-%s">%s</a> table' % (t, t)
+            elif t in schema_remarks.table_remark:
+                return 'the %s table' % t
+        elif kind == 'table':
+            if rest in self.schema:
+                return '<a href="#table-%s">%s</a>' % (rest, rest)
+            elif rest in schema_remarks.table_remark:
+                return rest
+        elif kind == 'column' or kind == 'index':
+            # Table names and column names may not contain '-', but
+            # try each way of splitting the key, just in case.
+            pos = rest.find('-')
+            while pos >= 0:
+                value = self.member_link(kind, rest[:pos], rest[pos + 1 :])
+                if value is not None:
+                    return value
+                pos = rest.find('-', pos + 1)
+        return None
+
+    def member_link(self, kind, t, name):
+        if kind == 'column':
+            (sep, part, renamed, remarks) = (
+                '.',
+                1,
+                schema_remarks.column_renamed,
+                schema_remarks.column_remark,
+            )
+        else:
+            (sep, part, renamed, remarks) = (
+                ':',
+                2,
+                schema_remarks.index_renamed,
+                schema_remarks.index_remark,
+            )
+        if t in self.schema:
+            members = self.schema[t][part]
+        else:
+            members = {}
+        if t in schema_remarks.table_remark and name in renamed.get(t, {}):
+            canon = renamed[t][name]
+            alts = list(renamed[t].keys())
+            if name not in members and (
+                canon in members or canon in alts[: alts.index(name)]
+            ):
+                return '<a href="#%s-%s-%s">%s%s%s</a>' % (
+                    kind,
+                    t,
+                    canon,
+                    t,
+                    sep,
+                    name,
+                )
+            return '%s%s%s' % (t, sep, name)
+        if name in members:
+            return '<a href="#%s-%s-%s">%s%s%s</a>' % (kind, t, name, t, sep, name)
+        if t in schema_remarks.table_remark and name in remarks.get(t, {}):
+            return '%s%s%s' % (t, sep, name)
+        return None
+
+
+def make_output_dict(schema, bugzilla_versions, ctx=None):
+    if ctx is not None:
+        ctx.use('notation_guide')
+        ctx.use('column_renamed')
+        ctx.use('index_renamed')
+        ctx.use('keys:table_remark')
+        ctx.use('keys:column_remark')
+        ctx.use('keys:index_remark')
+    dict = LinkDict(schema)
     dict['FIRST_VERSION'] = bugzilla_versions[0]
     dict['LAST_VERSION'] = bugzilla_versions[-1]
     if len(bugzilla_versions) == 1:
         dict['NOTATION_GUIDE'] = ''
         dict['BUGZILLA_VERSIONS'] = "version " + bugzilla_versions[0]
     else:
-        dict['NOTATION_GUIDE'] = schema_remarks.notation_guide % dict
+        dict['NOTATION_GUIDE'] = render(schema_remarks.notation_guide, dict)
         dict['BUGZILLA_VERSIONS'] = (
             "versions "
             + str.join(', ', bugzilla_versions[:-1])
             + ' and '
             + bugzilla_versions[-1]
         )
-    tables = list(schema.keys())
-    for table in tables:
-        dict['the-table-%s' % table] = 'the <a href="#table-%s">%s</a> table' % (
-            table,
-            table,
-        )
-        dict['table-%s' % table] = '<a href="#table-%s">%s</a>' % (table, table)
-        (versions, columns, indexes) = schema[table]
-        for c in list(columns.keys()):
-            dict['column-%s-%s' % (table, c)] = '<a href="#column-%s-%s">%s.%s</a>' % (
-                table,
-                c,
-                table,
-                c,
-            )
-        for i in list(indexes.keys()):
-            dict['index-%s-%s' % (table, i)] = '<a href="#index-%s-%s">%s:%s</a>' % (
-                table,
-                i,
-                table,
-                i,
-            )
-    for t in list(schema_remarks.table_remark.keys()):
-        k = 'the-table-%s' % t
-        if k not in dict:
-            dict[k] = 'the %s table' % t
-            dict['table-%s' % t] = t
-        if t in schema_remarks.column_renamed:
-            for (alt, canon) in list(schema_remarks.column_renamed[t].items()):
-                kcanon = 'column-%s-%s' % (t, canon)
-                kalt = 'column-%s-%s' % (t, alt)
-                if (
-                    kcanon in dict and kalt not in dict
-                ):  # the canonical name is in the schema
-                    dict[kalt] = '<a href="#column-%s-%s">%s.%s</a>' % (
-                        t,
-                        canon,
-                        t,
-                        alt,
-                    )
-                else:
-                    dict[kalt] = '%s.%s' % (t, alt)
-        if t in schema_remarks.index_renamed:
-            for (alt, canon) in list(schema_remarks.index_renamed[t].items()):
-                kcanon = 'index-%s-%s' % (t, canon)
-                kalt = 'index-%s-%s' % (t, alt)
-                if (
-                    kcanon in dict and kalt not in dict
-                ):  # the canonical name is in the schema
-                    dict[kalt] = '<a href="#index-%s-%s">%s:%s</a>' % (t, canon, t, alt)
-                else:
-                    dict[kalt] = '%s:%s' % (t, alt)
-        for c in list(schema_remarks.column_remark[t].keys()):
-            k = 'column-%s-%s' % (t, c)
-            if k not in dict:
-                dict[k] = '%s.%s' % (t, c)
-        for i in list(schema_remarks.index_remark[t].keys()):
-            k = 'index-%s-%s' % (t, i)
-            if k not in dict:
-                dict[k] = '%s:%s' % (t, i)
-
     return dict
 
 
@@ -360,16 +629,28 @@ def tables_tables(tables_table_rows, quick_tables_table_rows, dict):
     dict['TABLES_TABLE'] = tables_table
 
 
-def output_schema(schema, remarks, colours, bugzilla_versions):
-    global body
-    body = []
-    dict = make_output_dict(schema, bugzilla_versions)
+# Prepare to output a versioned schema: make the dictionary for
+# formatting remarks, including the tables of tables, and work out the
+# remark for each table.  Returns a list of (table, colour, remark)
+# triples, in the order the tables are output.
+
+
+def prepare_output(ctx, schema, remarks, colours, bugzilla_versions):
+    with ctx.phase('output_dict'):
+        dict = make_output_dict(schema, bugzilla_versions, ctx)
+    ctx.dict = dict
+    with ctx.phase('table_remarks'):
+        return table_rows(ctx, schema, remarks, colours, bugzilla_versions)
+
+
+def table_rows(ctx, schema, remarks, colours, bugzilla_versions):
+    dict = ctx.dict
     tables_table_rows = []
     quick_tables_table_rows = []
+    rows = []
     tables = list(schema.keys())
     tables.sort()
     for table in tables:
-        (versions, columns, indexes) = schema[table]
         colour = colours[table]['']
         thisremarks = remarks[table]
         if not isinstance(thisremarks, list):
@@ -384,32 +665,63 @@ def output_schema(schema, remarks, colours, bugzilla_versions):
         quick_tables_table_rows.append(
             '<th%s><a href="#table-%s">%s</a></th>\n\n' % (colour, table, table)
         )
-        # if the table was modified, we only want to color the things in it
-        # that were modified below this point, not the entire table.
-        if colour == blue:
-            colour = ''
-        add(
-            '<h3><a id="table-%s" name="table-%s">The "%s" table</a></h3>\n\n\n'
-            % (table, table, table)
-        )
-        output_description(
-            table,
-            colour,
-            remark,
-            columns,
-            colours[table]['column'],
-            dict,
-            bugzilla_versions,
-        )
-        if indexes:
-            add('<p>Indexes:</p>\n\n')
-            output_indexes(
-                table, colour, indexes, colours[table]['index'], dict, bugzilla_versions
-            )
-        else:
-            add('<p>The "%s" table has no indexes.</p>' % table)
+        rows.append((table, colour, remark))
     tables_tables(tables_table_rows, quick_tables_table_rows, dict)
-    return (dict, body)
+    return rows
+
+
+# Format the remarks of every column and index in a versioned schema,
+# replacing the Remarks of each Column and Index with the formatted
+# string ('-' if there are none).  This is done before any table is
+# output, so that a remark which can't be formatted (for instance, one
+# with a cross-reference to something which doesn't exist) is found
+# before any of the document is sent (see stream_tables()).
+
+
+def format_member_remarks(ctx, schema, bv):
+    dict = ctx.dict
+    for table in schema:
+        (versions, columns, indexes) = schema[table]
+        for members in (columns, indexes):
+            for (name, record) in list(members.items()):
+                if record.Remarks:
+                    remarks = [process(r, bv, dict) for r in record.Remarks]
+                    remarks = str.join(' ', remarks)
+                else:
+                    remarks = '-'
+                members[name] = record._replace(Remarks=remarks)
+
+
+# Output the description of one table.  The remarks of its columns and
+# indexes must already have been formatted by format_member_remarks().
+
+
+def output_table(ctx, schema, table, colour, remark, colours):
+    add = ctx.add
+    (versions, columns, indexes) = schema[table]
+    # if the table was modified, we only want to color the things in it
+    # that were modified below this point, not the entire table.
+    if colour == blue:
+        colour = ''
+    add(
+        '<h3><a id="table-%s" name="table-%s">The "%s" table</a></h3>\n\n\n'
+        % (table, table, table)
+    )
+    output_description(ctx, table, colour, remark, columns, colours[table]['column'])
+    if indexes:
+        add('<p>Indexes:</p>\n\n')
+        output_indexes(ctx, table, colour, indexes, colours[table]['index'])
+    else:
+        add('<p>The "%s" table has no indexes.</p>' % table)
+
+
+def output_schema(ctx, schema, remarks, colours, bugzilla_versions):
+    rows = prepare_output(ctx, schema, remarks, colours, bugzilla_versions)
+    with ctx.phase('remarks'):
+        format_member_remarks(ctx, schema, bugzilla_versions)
+    for (table, colour, remark) in rows:
+        output_table(ctx, schema, table, colour, remark, colours)
+    return (ctx.dict, ctx.body)
 
 
 # 6. Code to read all the database schemas and figure out the history
@@ -458,37 +770,6 @@ def init_colours(colours, t, cols, inds):
 # So list[-1][1] is the current value.  When we're done figuring out
 # the schema history, we replace this list with a single value.
 
-# Make the initial pair lists for a column.
-
-
-def pair_up_column_entries(bz, column):
-    for k in ['Name', 'Type', 'Default', 'Properties']:
-        column[k] = [(bz, column[k])]
-
-
-# Make the initial pair lists for an index.
-
-
-def pair_up_index_entries(bz, index):
-    for k in ['Name', 'Fields', 'Properties']:
-        index[k] = [(bz, index[k])]
-
-
-# Make all the initial pair lists for a table.
-
-
-def pair_up_table_entries(bz, schema, table):
-    (columns, indexes) = schema[table]
-    for c in list(columns.values()):
-        pair_up_column_entries(bz, c)
-    for i in list(indexes.values()):
-        pair_up_index_entries(bz, i)
-
-
-def pair_up_schema(bz, schema):
-    for t in list(schema.keys()):
-        pair_up_table_entries(bz, schema, t)
-
 
 # Given a pair list, make a single value which explains the history.
 # I've tried various ways of showing this; this is the best I've come
@@ -564,19 +845,31 @@ def stringify_type(pl):
     return stringify_pairs(newpl)
 
 
-# Given a schema, fix up all the pair lists.
+# Given a versioned schema, replace the record of each column and
+# index, with its pair lists, by a Column or Index (see get_schema.py)
+# explaining its history.
 
 
 def stringify_schema(schema):
     for table in list(schema.keys()):
         (versions, columns, indexes) = schema[table]
-        for c in list(columns.values()):
-            c['Type'] = stringify_type(c['Type'])
-            for k in ['Name', 'Default', 'Properties']:
-                c[k] = stringify_pairs(c[k])
-        for i in list(indexes.values()):
-            for k in ['Name', 'Fields', 'Properties']:
-                i[k] = stringify_pairs(i[k])
+        for c in list(columns.keys()):
+            crec = columns[c]
+            columns[c] = get_schema.Column(
+                Name=stringify_pairs(crec['Name']),
+                Default=stringify_pairs(crec['Default']),
+                Type=stringify_type(crec['Type']),
+                Properties=stringify_pairs(crec['Properties']),
+                Remarks=tuple(crec['Remarks']),
+            )
+        for i in list(indexes.keys()):
+            irec = indexes[i]
+            indexes[i] = get_schema.Index(
+                Name=stringify_pairs(irec['Name']),
+                Fields=stringify_pairs(irec['Fields']),
+                Properties=stringify_pairs(irec['Properties']),
+                Remarks=tuple(irec['Remarks']),
+            )
 
 
 def make_annotation(base, note):
@@ -586,76 +879,164 @@ def make_annotation(base, note):
         return ' <b>%s.</b>\n' % base
 
 
-# Given a list of schemas, produce a single versioned schema, fill in
-# the colour tables and add to all the remarks reflecting schema
-# versions in which particular tables/columns/indexes are added and/or
+# The presence of a table, column or index in the schemas being
+# compared is recorded as a bitmask: bit j is set if it is present in
+# the j'th schema.  A column or index can only be present when its
+# table is, so changes in its presence are found relative to the
+# table's bitmask.
+
+
+# Iterate over the positions of the bits set in a mask, lowest first.
+
+
+def mask_bits(mask):
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+# Return a mask of the positions in 'within', apart from the first,
+# at which 'mask' differs from its value at the previous position in
+# 'within'.  These are the schemas in which something was added or
 # removed.
 
 
-def make_versioned_schema(schema_list, colours, table_remarks):
-    # Pivot so we get a map from table/column/index to paired lists of
-    # properties and lists of BZ versions.  Fill in blue cells while
-    # we're doing this.
+def presence_changes(mask, within):
+    low = within & -within
+    if within & (within + low) == 0:
+        # 'within' is a single run of bits, so the previous position
+        # is always the next lower bit.
+        return (mask ^ (mask << 1)) & within & ~low
+    changes = 0
+    previous = mask & low
+    rest = within & ~low
+    while rest:
+        bit = rest & -rest
+        if bool(mask & bit) != bool(previous):
+            changes |= bit
+        previous = mask & bit
+        rest ^= bit
+    return changes
+
+
+# Given a list of (Bugzilla version, schema) pairs, produce a single
+# versioned schema, fill in the colour tables and add to all the
+# remarks reflecting schema versions in which particular
+# tables/columns/indexes are added and/or removed.  The schemas
+# themselves are not modified.  In the versioned schema, each table is
+# a triple (versions, columns, indexes), and each column and index has
+# a record mapping 'versions' to its presence bitmask, 'Remarks' to a
+# list of remarks, and each other field to a pair list.  'versions' in
+# the table triple is also a presence bitmask.
+#
+# This is done in two steps: pivot_schemas() makes the versioned
+# schema, and annotate_versioned_schema() works out the colours and
+# remarks.  A versioned schema can also be sliced out of the schema
+# timeline (see schema_timeline.py) instead of being pivoted.
+
+
+def make_versioned_schema(ctx, schema_list, colours, table_remarks):
+    tables = pivot_schemas(schema_list)
+    bzs = [bz for (bz, schema) in schema_list]
+    annotate_versioned_schema(ctx, tables, bzs, colours, table_remarks)
+    return tables
+
+
+# Pivot so we get a map from table/column/index to paired lists of
+# properties and presence bitmasks.  Tables are [versions, columns,
+# indexes] lists until they are annotated.
+
+
+def pivot_schemas(schema_list):
     tables = {}
-    bzs = []
-    for (bz, schema) in schema_list:
-        bzs.append(bz)
+    for (j, (bz, schema)) in enumerate(schema_list):
+        bit = 1 << j
         for t in list(schema.keys()):
             if t not in tables:
-                tables[t] = ([], {}, {})
-                if t in schema_remarks.table_remark:
-                    remark = schema_remarks.table_remark[t]
-                    if remark is None:
-                        remark = []
-                    elif type(remark) == bytes:
-                        remark = [remark]
-                    else:
-                        remark = remark[:]
-                else:
-                    remark = []
-                table_remarks[t] = remark
-            tables[t][0].append(bz)
+                tables[t] = [0, {}, {}]
+            tables[t][0] |= bit
             (cols, inds) = schema[t]
-            init_colours(colours, t, list(cols.keys()), list(inds.keys()))
-            for c in list(cols.keys()):
-                crec = tables[t][1].get(c, {'versions': []})
+            for c, col in cols.items():
+                crec = tables[t][1].get(c, {'versions': 0})
                 tables[t][1][c] = crec
-                crec['versions'].append(bz)
+                crec['versions'] |= bit
                 for k in ['Name', 'Default', 'Type', 'Properties']:
-                    if k in crec and crec[k][-1][1] != cols[c][k][0][1]:
-                        colours[t]['column'][c][k] = blue
-                        colours[t][''] = blue
                     crec[k] = crec.get(k, [])
-                    crec[k] += cols[c][k]
-                    crec['Remarks'] = cols[c]['Remarks']
-            for i in list(inds.keys()):
-                irec = tables[t][2].get(i, {'versions': []})
+                    crec[k].append((bz, getattr(col, k)))
+                crec['Remarks'] = list(col.Remarks)
+            for i, ind in inds.items():
+                irec = tables[t][2].get(i, {'versions': 0})
                 tables[t][2][i] = irec
-                irec['versions'].append(bz)
+                irec['versions'] |= bit
                 for k in ['Name', 'Fields', 'Properties']:
-                    if k in irec and irec[k][-1][1] != inds[i][k][0][1]:
-                        colours[t]['index'][i][k] = blue
-                        colours[t][''] = blue
                     irec[k] = irec.get(k, [])
-                    irec[k] += inds[i][k]
-                    irec['Remarks'] = inds[i]['Remarks']
+                    irec[k].append((bz, getattr(ind, k)))
+                irec['Remarks'] = list(ind.Remarks)
+    return tables
+
+
+# Does a pair list have more than one value?
+
+
+def pairs_change(pl):
+    value = pl[0][1]
+    for p in pl:
+        if p[1] != value:
+            return True
+    return False
+
+
+# Given a pivoted schema and the list of Bugzilla versions to which its
+# presence bitmasks refer, fill in the colours and table_remarks, and
+# add to the column and index remarks.
+
+
+def annotate_versioned_schema(ctx, tables, bzs, colours, table_remarks):
+    errors = ctx.errors
+    # Fill in the table remarks, and the blue cells for changed fields.
+    for t in list(tables.keys()):
+        if t in schema_remarks.table_remark:
+            remark = schema_remarks.table_remark[t]
+            if remark is None:
+                remark = []
+            elif type(remark) == bytes:
+                remark = [remark]
+            else:
+                remark = remark[:]
+        else:
+            remark = []
+        table_remarks[t] = remark
+        (v, cols, inds) = tables[t]
+        init_colours(colours, t, list(cols.keys()), list(inds.keys()))
+        for c, crec in cols.items():
+            for k in ['Name', 'Default', 'Type', 'Properties']:
+                if pairs_change(crec[k]):
+                    colours[t]['column'][c][k] = blue
+                    colours[t][''] = blue
+        for i, irec in inds.items():
+            for k in ['Name', 'Fields', 'Properties']:
+                if pairs_change(irec[k]):
+                    colours[t]['index'][i][k] = blue
+                    colours[t][''] = blue
 
     # Now we know all the tables, columns, indexes in our report,
     # and what versions of bugzilla each one appears in.
     # Figure out all the colours and remarks accordingly.
-    first_bz = schema_list[0][0]
-    last_bz = schema_list[-1][0]
+    first_bit = 1
+    last_bit = 1 << (len(bzs) - 1)
+    all_bits = (last_bit << 1) - 1
     for t in list(tables.keys()):
+        tables[t] = tuple(tables[t])
         v = tables[t][0]
-        if last_bz not in v:  # not in last version: red
+        if not v & last_bit:  # not in last version: red
             colours[t][''] = red
-        elif first_bz not in v:  # not in first version: green
+        elif not v & first_bit:  # not in first version: green
             colours[t][''] = green
         # don't colour tables blue, so we're done
-        present = first_bz in v
-        for bz in bzs:
-            if present and (bz not in v):  # removed in this version
-                present = False
+        for j in mask_bits(presence_changes(v, all_bits)):
+            bz = bzs[j]
+            if not v & (1 << j):  # removed in this version
                 if t in schema_remarks.table_removed_remark:
                     note = schema_remarks.table_removed_remark[t]
                     note = make_annotation('Removed in %s' % bz, note)
@@ -664,8 +1045,7 @@ def make_versioned_schema(schema_list, colours, table_remarks):
                     table_remarks[t].append(note)
                 else:
                     errors.append('No remark to remove table %s' % t)
-            elif (not present) and (bz in v):  # added in this version
-                present = True
+            else:  # added in this version
                 if t in schema_remarks.table_added_remark:
                     note = schema_remarks.table_added_remark[t]
                     note = make_annotation('Added in %s' % bz, note)
@@ -678,20 +1058,22 @@ def make_versioned_schema(schema_list, colours, table_remarks):
         # now the columns:
         for c in list(tables[t][1].keys()):
             v = tables[t][1][c]['versions']
-            if last_bz not in v:
+            if not v & last_bit:
                 colours[t]['column'][c][''] = red
                 if colours[t][''] == '':
                     colours[t][''] = blue
-            elif first_bz not in v:
+            elif not v & first_bit:
                 colours[t]['column'][c][''] = green
                 if colours[t][''] == '':
                     colours[t][''] = blue
             # don't colour whole column rows blue, so we're done
-            present = tables[t][0][0] in v
-            for bz in tables[t][0]:
-                if present and (bz not in v):
+            if v == tables[t][0]:
+                # present whenever the table is
+                continue
+            for j in mask_bits(presence_changes(v, tables[t][0])):
+                bz = bzs[j]
+                if not v & (1 << j):
                     # removed in this version
-                    present = False
                     if (
                         t in schema_remarks.column_removed_remark
                         and c in schema_remarks.column_removed_remark[t]
@@ -702,9 +1084,8 @@ def make_versioned_schema(schema_list, colours, table_remarks):
                         note = None
                     note = make_annotation('Removed in %s' % bz, note)
                     tables[t][1][c]['Remarks'].append(note)
-                elif (not present) and (bz in v):
+                else:
                     # added in this version
-                    present = True
                     if (
                         t in schema_remarks.column_added_remark
                         and c in schema_remarks.column_added_remark[t]
@@ -719,20 +1100,22 @@ def make_versioned_schema(schema_list, colours, table_remarks):
         # now the indexes:
         for i in list(tables[t][2].keys()):
             v = tables[t][2][i]['versions']
-            if last_bz not in v:
+            if not v & last_bit:
                 colours[t]['index'][i][''] = red
                 if colours[t][''] == '':
                     colours[t][''] = blue
-            elif first_bz not in v:
+            elif not v & first_bit:
                 colours[t]['index'][i][''] = green
                 if colours[t][''] == '':
                     colours[t][''] = blue
             # don't colour whole index rows blue, so we're done
-            present = tables[t][0][0] in v
-            for bz in tables[t][0]:
-                if present and (bz not in v):
+            if v == tables[t][0]:
+                # present whenever the table is
+                continue
+            for j in mask_bits(presence_changes(v, tables[t][0])):
+                bz = bzs[j]
+                if not v & (1 << j):
                     # removed in this version
-                    present = False
                     if (
                         t in schema_remarks.index_removed_remark
                         and i in schema_remarks.index_removed_remark[t]
@@ -743,9 +1126,8 @@ def make_versioned_schema(schema_list, colours, table_remarks):
                         note = None
                     note = make_annotation('Removed in %s' % bz, note)
                     tables[t][2][i]['Remarks'].append(note)
-                elif (not present) and (bz in v):
+                else:
                     # added in this version
-                    present = True
                     if (
                         t in schema_remarks.index_added_remark
                         and i in schema_remarks.index_added_remark[t]
@@ -759,25 +1141,75 @@ def make_versioned_schema(schema_list, colours, table_remarks):
     return tables
 
 
-# get all the schemas and combine them.
+# Make the versioned schema by reading each schema in the range.  If
+# 'tables' is given, only those tables are read from each schema.
+# Returns a triple (bzs, errors, tables) like
+# schema_timeline.versioned_tables(): consecutive versions with the
+# same schema are only read once.  'count' is passed on to
+# get_schema.get_lazy_schema().
 
 
-def get_versioned_tables(first, last):
-    global errors
+def read_versioned_tables(first, last, tables=None, count=None):
     errors = []
-    if not first in schema_remarks.version_order:
-        raise BzSchemaProcessingException([f"I don't know about version '{last}'."])
-    if not last in schema_remarks.version_order:
+    schema_list = []
+    previous = None
+    for bz in version_range(first, last):
+        name = schema_remarks.version_schema_map[bz]
+        if name == previous:
+            continue
+        previous = name
+        (schema, errors) = get_schema.get_lazy_schema(name, errors, count)
+        subset = {}
+        for t in schema:
+            if tables is None or t in tables:
+                subset[t] = schema[t]
+                errors.extend(schema.table_errors(t))
+        schema_list.append((bz, subset))
+    versioned = pivot_schemas(schema_list)
+    for t in tables or []:
+        if t not in versioned:
+            errors.append(
+                f"Table '{t}' is not in the schema for any version from '{first}'"
+                f" to '{last}'."
+            )
+    return ([bz for (bz, schema) in schema_list], errors, versioned)
+
+
+# Get all the schemas and combine them, returning the pair (bzs,
+# schema): the Bugzilla versions in which the schema changes, and the
+# pivoted versioned schema (see pivot_schemas()), before it is
+# annotated.  If 'tables' is given, only those tables are in the
+# versioned schema.  Errors in the schemas are fatal.
+#
+# The versioned schema of all the tables is sliced out of the schema
+# timeline if the range has more than SHORT_RANGE_SCHEMAS schemas and
+# the timeline is in memory or saved, up to date.  Otherwise the
+# schemas are read, which is quicker for a short range, and much
+# quicker than building the timeline.
+
+SHORT_RANGE_SCHEMAS = 2
+
+
+def range_schemas(first, last):
+    names = set()
+    for bz in version_range(first, last):
+        names.add(schema_remarks.version_schema_map[bz])
+    return len(names)
+
+
+
+def versioned_schema(first, last, ctx=None, tables=None):
+    if ctx is None:
+        ctx = RenderContext()
+    errors = ctx.errors
+    if not is_version(first):
+        raise BzSchemaProcessingException([f"I don't know about version '{first}'."])
+    if not is_version(last):
         raise BzSchemaProcessingException([f"I don't know about version '{last}'."])
-    if not (
-        schema_remarks.version_order.index(last)
-        >= schema_remarks.version_order.index(first)
-    ):
+    if version_compare(last, first) < 0:
         raise BzSchemaProcessingException(
             [f"Version '{last}' comes before version '{first}'."]
         )
-    colours = {}
-    tr = {}
     if not first in schema_remarks.version_schema_map:
         raise BzSchemaProcessingException(
             [
@@ -792,31 +1224,53 @@ def get_versioned_tables(first, last):
                 " for it."
             ]
         )
-    schema_name = schema_remarks.version_schema_map[first]
-    schema, errors = get_schema.get_schema(schema_name, errors)
-    # turn fields into lists connecting Bugzilla version to value
-    pair_up_schema(first, schema)
-    schemas = [(first, schema)]
-    bugzilla_versions = schema_remarks.version_order[
-        (schema_remarks.version_order.index(first)) : (
-            schema_remarks.version_order.index(last) + 1
-        )
-    ]
-    for bz_name in bugzilla_versions[1:]:
-        new_schema_name = schema_remarks.version_schema_map[bz_name]
-        if new_schema_name == schema_name:
-            continue
-        schema_name = new_schema_name
-        new_schema, errors = get_schema.get_schema(schema_name, errors)
-        pair_up_schema(bz_name, new_schema)
-        schemas.append((bz_name, new_schema))
+    versioned_schemas.inc('all' if tables is None else 'some')
+    timeline = None
+    if tables is None and range_schemas(first, last) > SHORT_RANGE_SCHEMAS:
+        with ctx.phase('timeline'):
+            timeline = schema_timeline.get_timeline(ctx.count, build=False)
+    with ctx.phase('versioned_tables'):
+        if timeline is not None:
+            (bzs, schema_errors, schema) = schema_timeline.versioned_tables(
+                timeline, first, last
+            )
+        else:
+            (bzs, schema_errors, schema) = read_versioned_tables(
+                first, last, tables, ctx.count
+            )
+    errors.extend(schema_errors)
+    ctx.count('schemas', len(bzs))
+    ctx.use('version_order')
+    ctx.use('version_schema_map')
+    for bz in bzs:
+        ctx.use('schema', schema_remarks.version_schema_map[bz])
     # if we have errors at this point, it's fatal, there's no point
-    # in letting make_versioned_schema spew a ton more of them.
+    # in letting annotate_versioned_schema spew a ton more of them.
     if errors:
         raise BzSchemaProcessingException(errors)
-    schema = make_versioned_schema(schemas, colours, tr)
-    stringify_schema(schema)
-    return (schema, tr, colours, tuple(bugzilla_versions), errors)
+    return (bzs, schema)
+
+
+# get all the schemas and combine them, and annotate the versioned
+# schema.  If 'tables' is given, only those tables are in the
+# versioned schema.
+
+
+def get_versioned_tables(first, last, ctx=None, tables=None):
+    if ctx is None:
+        ctx = RenderContext()
+    (bzs, schema) = versioned_schema(first, last, ctx, tables)
+    colours = {}
+    tr = {}
+    for t in schema:
+        for name in table_remark_names:
+            ctx.use(name, t)
+    with ctx.phase('annotate'):
+        annotate_versioned_schema(ctx, schema, bzs, colours, tr)
+    with ctx.phase('stringify'):
+        stringify_schema(schema)
+    bugzilla_versions = version_range(first, last)
+    return (schema, tr, colours, tuple(bugzilla_versions), ctx.errors)
 
 
 def make_version_table(versions):
@@ -846,34 +1300,86 @@ def strip_p4_id(id):
 # generate our Bugzilla schema doc.  Note that although it will
 # generate schema diffs for various version ranges, the prelude and
 # afterword it adds are specific to certain Bugzilla versions.
-
-
-def make_tables(first, last):
-    global errors
-    (schema, tr, colours, bv, errors) = get_versioned_tables(first, last)
-    (dict, html) = output_schema(schema, tr, colours, bv)
-    dict['VERSIONS_TABLE'] = make_version_table(bv)
-    dict['TIME'] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time()))
-    dict['DATE'] = time.strftime("%Y-%m-%d", time.gmtime(time.time()))
-    dict['SCRIPT_ID'] = strip_p4_id('$Id$')
-    dict['REMARKS_ID'] = strip_p4_id(schema_remarks.remarks_id)
-    body = (
-        process(schema_remarks.prelude, bv, dict)
-        + process(html, bv, dict)
-        + process(schema_remarks.afterword, bv, dict)
-    )
-    header = process(schema_remarks.header, bv, dict)
-    footer = process(schema_remarks.footer, bv, dict)
+#
+# If 'tables' is given, the document only describes those tables, and
+# only they are read from the schemas; references in the remarks to
+# other tables are not links.  If 'ctx' is given, the document is
+# generated in that RenderContext, so the caller can see its inputs.
+#
+# The document is generated by stream_tables(), which returns a triple
+# (header, chunks, footer).  'chunks' is an iterator over the body of
+# the document: the prelude, the description of each table in turn,
+# and the afterword.  All the work which can find errors in the
+# schemas or remarks is done before stream_tables() returns: the
+# versioned schema is made and checked, and every remark in the
+# document (of the tables, columns and indexes, and the prelude and
+# afterword) is formatted.  The body can then be written out as it is
+# generated, as making it only puts the formatted parts together.
+
+
+def stream_tables(first, last, tables=None, ctx=None):
+    if ctx is None:
+        ctx = RenderContext()
+    for name in ['prelude', 'afterword', 'header', 'footer', 'version_remark']:
+        ctx.use(name)
+    ctx.use('remarks_id')
+    (schema, tr, colours, bv, errors) = get_versioned_tables(first, last, ctx, tables)
     if errors:
         raise BzSchemaProcessingException(errors)
-    return (header, body, footer)
+    rows = prepare_output(ctx, schema, tr, colours, bv)
+    dict = ctx.dict
+    with ctx.phase('header'):
+        dict['VERSIONS_TABLE'] = make_version_table(bv)
+        dict['TIME'] = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(time.time()))
+        dict['DATE'] = time.strftime("%Y-%m-%d", time.gmtime(time.time()))
+        dict['SCRIPT_ID'] = strip_p4_id('$Id$')
+        dict['REMARKS_ID'] = strip_p4_id(schema_remarks.remarks_id)
+        header = process(schema_remarks.header, bv, dict)
+        footer = process(schema_remarks.footer, bv, dict)
+    with ctx.phase('remarks'):
+        format_member_remarks(ctx, schema, bv)
+    with ctx.phase('body'):
+        prelude = process(schema_remarks.prelude, bv, dict)
+        afterword = process(schema_remarks.afterword, bv, dict)
+    chunks = body_chunks(ctx, schema, rows, colours, prelude, afterword)
+    return (header, chunks, footer)
+
+
+def body_chunks(ctx, schema, rows, colours, prelude, afterword):
+    chunk = prelude
+    ctx.count('characters', len(chunk))
+    yield chunk
+    for (table, colour, remark) in rows:
+        with ctx.phase('body'):
+            ctx.body = []
+            output_table(ctx, schema, table, colour, remark, colours)
+            chunk = str.join('', ctx.body)
+        (versions, columns, indexes) = schema[table]
+        ctx.count('tables')
+        ctx.count('columns', len(columns))
+        ctx.count('indexes', len(indexes))
+        ctx.count('characters', len(chunk))
+        yield chunk
+    chunk = afterword
+    ctx.count('characters', len(chunk))
+    yield chunk
+
+
+def make_tables(first, last, tables=None, ctx=None):
+    (header, chunks, footer) = stream_tables(first, last, tables, ctx)
+    return (header, str.join('', chunks), footer)
 
 
-def make_body(first, last):
-    (header, body, footer) = make_tables(first, last)
+def make_body(first, last, tables=None):
+    (header, body, footer) = make_tables(first, last, tables)
     return body
 
 
+def stream_body(first, last, tables=None, ctx=None):
+    (header, chunks, footer) = stream_tables(first, last, tables, ctx)
+    return chunks
+
+
 # A. REFERENCES
 #
 #
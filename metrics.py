@@ -0,0 +1,272 @@
+#             Perforce Defect Tracking Integration Project
+#              <http://www.ravenbrook.com/project/p4dti/>
+#
+#           METRICS.PY -- OPERATIONAL METRICS FOR THE SCHEMA SERVICE
+#
+#
+# 1. INTRODUCTION
+#
+# This module keeps metrics about the work done by a long-running
+# schema service (see section 7 of index.py): counters, gauges and
+# histograms, each possibly split by labels, in a registry which can be
+# written out in the Prometheus text format [Prometheus], for the
+# 'metrics' action of index.py.
+#
+# The metrics are kept in the memory of one process, so each worker
+# process of a server has its own; Prometheus adds them up.  A CGI
+# process only serves one request, so its metrics are of no use.
+#
+# The intended readership is project developers.
+#
+# This document is not confidential.
+
+import bisect
+import threading
+
+# 2. Metrics.
+#
+# Each metric has a name, a help string, and a list of label names.
+# Its samples are kept in a dictionary mapping a tuple of label values
+# (in the order of the label names) to the value.  All the metrics are
+# safe to update from several threads at once.
+
+PREFIX = 'bugzilla_schema_'
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *label_values, n=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + n
+
+    # Return a list of triples (name, labels, value) for the samples of
+    # the metric, where 'labels' is a list of pairs (label, value).
+    def samples(self):
+        with self.lock:
+            values = sorted(self.values.items())
+        return [
+            (self.name, list(zip(self.labels, label_values)), value)
+            for (label_values, value) in values
+        ]
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def dec(self, *label_values, n=1):
+        self.inc(*label_values, n=-n)
+
+    def set(self, *label_values, value):
+        with self.lock:
+            self.values[label_values] = value
+
+
+# A histogram counts its observations in buckets: the bucket for an
+# upper bound counts the observations less than or equal to it.  The
+# samples are the cumulative count for each bucket, the count of all
+# observations, and their sum.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class Histogram(Counter):
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    # The value for each tuple of label values is a list of the counts
+    # in each bucket (not cumulative, with one more for the
+    # observations above the last bound), and the sum.
+    def observe(self, value, *label_values):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            if label_values not in self.values:
+                self.values[label_values] = [[0] * (len(self.buckets) + 1), 0]
+            entry = self.values[label_values]
+            entry[0][i] += 1
+            entry[1] += value
+
+    def samples(self):
+        with self.lock:
+            values = sorted(
+                (label_values, (list(counts), total))
+                for (label_values, (counts, total)) in self.values.items()
+            )
+        samples = []
+        for (label_values, (counts, total)) in values:
+            labels = list(zip(self.labels, label_values))
+            cumulative = 0
+            for (bound, count) in zip(self.buckets + ('+Inf',), counts):
+                cumulative += count
+                samples.append(
+                    (self.name + '_bucket', labels + [('le', str(bound))], cumulative)
+                )
+            samples.append((self.name + '_count', labels, cumulative))
+            samples.append((self.name + '_sum', labels, total))
+        return samples
+
+
+# A CacheMetrics reports the statistics of caches made by
+# functools.lru_cache(), which are only looked at when the metrics are
+# written out: the hits, the misses, and the number of entries in each
+# cache, labelled with the name of the cache.
+
+
+class CacheMetrics:
+    def __init__(self):
+        self.caches = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, function):
+        with self.lock:
+            self.caches[name] = function
+
+    def families(self):
+        with self.lock:
+            caches = sorted(self.caches.items())
+        hits = Counter('cache_hits', 'Lookups found in an in-process cache.', ['cache'])
+        misses = Counter(
+            'cache_misses', 'Lookups not found in an in-process cache.', ['cache']
+        )
+        entries = Gauge('cache_entries', 'Entries in an in-process cache.', ['cache'])
+        for (name, function) in caches:
+            info = function.cache_info()
+            hits.inc(name, n=info.hits)
+            misses.inc(name, n=info.misses)
+            entries.set(name, value=info.currsize)
+        return [hits, misses, entries]
+
+
+# 3. The registry.
+#
+# The metrics of this process are registered in 'registry' by the
+# modules which update them, when those modules are imported, using
+# the functions below.
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self.caches = CacheMetrics()
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.setdefault(metric.name, metric)
+            return self.metrics[metric.name]
+
+    # Return all the metrics, in the Prometheus text format [Prometheus].
+    def text(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        lines = []
+        for metric in metrics + self.caches.families():
+            name = metric.name
+            if metric.type == 'counter':
+                name += '_total'
+            lines.append('# HELP %s %s' % (name, escape_help(metric.help)))
+            lines.append('# TYPE %s %s' % (name, metric.type))
+            for (sample_name, labels, value) in metric.samples():
+                if metric.type == 'counter':
+                    sample_name += '_total'
+                lines.append(
+                    '%s%s %s'
+                    % (sample_name, format_labels(labels), format_value(value))
+                )
+        return str.join('', [line + '\n' for line in lines])
+
+
+def escape_help(s):
+    return s.replace('\\', '\\\\').replace('\n', '\\n')
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{%s}' % str.join(
+        ',',
+        [
+            '%s="%s"' % (label, escape_help(str(value)).replace('"', '\\"'))
+            for (label, value) in labels
+        ],
+    )
+
+
+def format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+registry = Registry()
+
+
+def counter(name, help, labels=()):
+    return registry.register(Counter(name, help, labels))
+
+
+def gauge(name, help, labels=()):
+    return registry.register(Gauge(name, help, labels))
+
+
+def histogram(name, help, labels=(), buckets=LATENCY_BUCKETS):
+    return registry.register(Histogram(name, help, labels, buckets))
+
+
+def cache(name, function):
+    registry.caches.add(name, function)
+
+
+# A. REFERENCES
+#
+# [Prometheus] "Exposition formats"; Prometheus Authors;
+# <https://prometheus.io/docs/instrumenting/exposition_formats/>.
+#
+#
+# B. DOCUMENT HISTORY
+#
+# 2026-10-18 AG  Created.
+#
+#
+# C. COPYRIGHT AND LICENSE
+#
+# This file is copyright (c) 2026 Bugzilla Project Contributors. All rights
+# reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# 1.  Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+# 2.  Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDERS AND CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+#
+# $Id$
@@ -0,0 +1,295 @@
+#             Perforce Defect Tracking Integration Project
+#              <http://www.ravenbrook.com/project/p4dti/>
+#
+#          PAGE_CACHE.PY -- A CACHE OF GENERATED SCHEMA DOCUMENTS
+#
+#
+# 1. INTRODUCTION
+#
+# This module caches the responses generated by index.py, so that a
+# schema document is only generated once for each query, however many
+# times it is asked for.  A document only depends on the query, the
+# schemas, schema_remarks.py and the code which generates it, so
+# cached responses are keyed by the query and a hash of the
+# modification times and sizes of those files (see input_hash()); when
+# any of them changes, every cached response is out of date, and is
+# generated again when it is next asked for.
+#
+# Each cached response has a strong entity tag (the hash of the
+# document) and the time it was generated, so index.py can send ETag
+# and Last-Modified headers, and answer conditional requests with "304
+# Not Modified" [RFC 9110, 13.1].
+#
+# There are two kinds of cache: a MemoryCache keeps the most recently
+# used responses in the memory of one process, and a DiskCache keeps
+# them in a directory, where they can be shared by several processes
+# (including CGI processes) and survive a restart.
+#
+# The intended readership is project developers.
+#
+# This document is not confidential.
+
+import collections
+import email.utils
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+import get_schema
+import make_schema_doc
+import lazy_remarks as schema_remarks
+import schema_store
+import schema_timeline
+
+# 2. The inputs to a document.
+#
+# These are the files which a generated document depends on: the code
+# which generates it (see code_paths(), which site_builder.py also
+# uses), schema_remarks.py and the schemas.  The input key identifies
+# them by their modification times and sizes, as the key of the schema
+# timeline does (see schema_timeline.timeline_key()), so that working it
+# out is cheap enough to do for every request, even a CGI request for a
+# cached page: the key of the schema store stands for all the schemas in
+# it, and only the pickles of schemas which are not in the store are
+# looked at.  The hash of the key is part of the key of every cached
+# response.  Touching a file without changing it makes the cached
+# responses out of date, which is harmless.
+
+
+def code_paths():
+    here = os.path.dirname(os.path.abspath(__file__))
+    return [
+        schema_remarks.__file__,
+        get_schema.__file__,
+        schema_store.__file__,
+        schema_timeline.__file__,
+        make_schema_doc.__file__,
+        os.path.join(here, 'schema_diff.py'),
+        os.path.join(here, 'index.py'),
+        __file__,
+    ]
+
+
+def input_key():
+    paths = [schema_remarks.source_path()] + code_paths()
+    key = [schema_timeline.file_key(path) for path in paths]
+    store = schema_store.get_store()
+    key.append(None if store is None else store.key)
+    for name in sorted(set(schema_remarks.version_schema_map.values())):
+        if store is None or not store.has_schema(name):
+            key.append(schema_timeline.file_key(get_schema.pickle_path(name)))
+    return tuple(key)
+
+
+def input_hash():
+    return hashlib.sha256(repr(input_key()).encode('utf-8')).hexdigest()
+
+
+# 3. Cached responses.
+#
+# A cached response is an Entry: the list of (name, value) HTTP headers
+# (not including ETag and Last-Modified), the encoded document, the
+# entity tag (including its quotes), and the time the document was
+# generated, in seconds since the epoch.
+
+Entry = collections.namedtuple(
+    'Entry', ['headers', 'document', 'etag', 'last_modified']
+)
+
+
+def make_entry(headers, document, generated):
+    etag = '"%s"' % hashlib.sha256(document).hexdigest()[:32]
+    return Entry(list(headers), document, etag, int(generated))
+
+
+# The headers to send with a cached response.
+
+
+def entry_headers(entry):
+    return [
+        ('ETag', entry.etag),
+        ('Last-Modified', email.utils.formatdate(entry.last_modified, usegmt=True)),
+    ]
+
+
+# Is a conditional request, with the If-None-Match and
+# If-Modified-Since headers given (or None), satisfied by the cached
+# response, so that "304 Not Modified" can be sent?  If-Modified-Since
+# is ignored if there is an If-None-Match header [RFC 9110, 13.1.3].
+
+
+def not_modified(entry, if_none_match, if_modified_since):
+    if if_none_match is not None:
+        for tag in if_none_match.split(','):
+            tag = tag.strip()
+            if tag.startswith('W/'):
+                tag = tag[2:]
+            if tag == '*' or tag == entry.etag:
+                return True
+        return False
+    if if_modified_since is not None:
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            return False
+        return entry.last_modified <= since.timestamp()
+    return False
+
+
+# 4. Cache backends.
+#
+# A cache backend has get(key), returning an Entry or None, and
+# put(key, entry).  Keys are tuples of strings (and None).
+
+
+# A MemoryCache keeps the most recently used responses, up to a total
+# of max_bytes of documents.
+
+MEMORY_CACHE_BYTES = 64 * 1024 * 1024
+
+
+class MemoryCache:
+    def __init__(self, max_bytes=MEMORY_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        if len(entry.document) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old.document)
+            self.entries[key] = entry
+            self.size += len(entry.document)
+            while self.size > self.max_bytes:
+                (_, old) = self.entries.popitem(last=False)
+                self.size -= len(old.document)
+
+
+# A DiskCache keeps responses in files in a directory, named by a hash
+# of the key.  Each file is a line of JSON with the key and the other
+# fields of the entry, followed by the document.  Files are replaced
+# atomically, so another process never sees part of one.  Failing to
+# read or write the cache is not an error: the document is just
+# generated again.  Nothing is ever removed from the directory; the
+# files for out-of-date inputs can be deleted at any time.
+
+
+class DiskCache:
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, key):
+        name = hashlib.sha256(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, name)
+
+    def get(self, key):
+        try:
+            with open(self.path(key), 'rb') as f:
+                meta = json.loads(f.readline())
+                document = f.read()
+        except (OSError, ValueError):
+            return None
+        if meta.get('key') != list(key):
+            return None
+        return Entry(
+            [tuple(h) for h in meta['headers']],
+            document,
+            meta['etag'],
+            meta['last_modified'],
+        )
+
+    def put(self, key, entry):
+        meta = {
+            'key': list(key),
+            'headers': entry.headers,
+            'etag': entry.etag,
+            'last_modified': entry.last_modified,
+        }
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            (fd, temp) = tempfile.mkstemp(dir=self.directory, prefix='.tmp')
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(json.dumps(meta).encode('utf-8') + b'\n')
+                f.write(entry.document)
+            os.chmod(temp, 0o644)
+            os.replace(temp, self.path(key))
+        except OSError:
+            try:
+                os.remove(temp)
+            except OSError:
+                pass
+
+
+# Make the cache for this process.  If the environment variable
+# BZ_SCHEMA_CACHE_DIR is set, responses are cached in that directory;
+# otherwise they are cached in memory.
+
+
+def make_cache(environ=os.environ):
+    directory = environ.get('BZ_SCHEMA_CACHE_DIR')
+    if directory:
+        return DiskCache(directory)
+    return MemoryCache()
+
+
+# A. REFERENCES
+#
+# [RFC 9110] "HTTP Semantics"; R. Fielding, M. Nottingham, J. Reschke;
+# IETF; 2022-06; <https://www.rfc-editor.org/rfc/rfc9110>.
+#
+#
+# B. DOCUMENT HISTORY
+#
+# 2026-10-18 AG  Created.
+#
+#
+# C. COPYRIGHT AND LICENSE
+#
+# This file is copyright (c) 2026 Bugzilla Project Contributors. All rights
+# reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# 1.  Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+# 2.  Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDERS AND CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+#
+# $Id$
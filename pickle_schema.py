@@ -10,16 +10,23 @@
 # 1. INTRODUCTION
 #
 # This module generates Python pickles of Bugzilla schemas, so that
-# they can be included in generated schema documentation.
+# they can be included in generated schema documentation.  Schemas are
+# normally read from MySQL, but can also be read from PostgreSQL or
+# SQLite (see section 2).
 #
 # The intended readership is project developers.
 #
 # This document is not confidential.
 
-import pickle
+import concurrent.futures
+import json
 import os
+import pickle
+import re
+import sqlite3
+import tempfile
+import threading
 
-import MySQLdb
 
 class BzSchemaPickleException(Exception):
     def __init__(self, message):
@@ -74,14 +81,14 @@ def fetch_rows_as_list_of_dictionaries(cursor, select):
     return results
 
 
-def pickle_schema(schema_version, db_name):
-    default_file = os.path.expanduser('~/.my.cnf')
-    db = MySQLdb.connect(
-        database=db_name,
-        read_default_file=default_file,
-        read_default_group='pickle_schema',
-    )
-    cursor = db.cursor()
+# The schema of a database is a map from table name to a pair (columns,
+# indexes): the rows returned by 'describe <table>' and 'show index from
+# <table>', as lists of dictionaries.  describe_schema() gets it by
+# running those queries for each table in turn: 2N+1 queries for N
+# tables.
+
+
+def describe_schema(cursor):
     tables = [x[0] for x in select_rows(cursor, 'show tables')]
     schema = {}
     for table in tables:
@@ -90,14 +97,623 @@ def pickle_schema(schema_version, db_name):
             cursor, 'show index from %s' % table
         )
         schema[table] = (columns, indexes)
-    db.close()
-    f = open('pickles/%s' % schema_version, 'wb')
-    pickle.dump((schema_version, schema), f)
-    f.close()
+    return schema
+
+
+# bulk_schema() gets the same schema with three queries however many
+# tables there are: 'show tables', then every column from
+# information_schema.COLUMNS and every index from
+# information_schema.STATISTICS, which are the tables 'describe' and
+# 'show index' report [MySQL].  This is much faster for a database with
+# many tables, especially over a slow connection.
+#
+# The rows are made to look like the rows from 'describe' and 'show
+# index', with the same keys in the same order, so that the pickles are
+# the same whichever way they are made:
+#
+# - The columns of STATISTICS are renamed to the names 'show index'
+#   uses (statistics_keys); its other columns, which name the database,
+#   are dropped.  Newer servers have more columns (such as 'Ignored' or
+#   'Visible'), and they are kept if they are in statistics_keys.
+#
+# - MariaDB writes COLUMN_DEFAULT as an SQL literal: NULL for a
+#   default of NULL, and a string default in quotes [MariaDB].
+#   'describe' shows the value itself, so sql_default() converts it.
+#
+# - Columns are ordered by their position in the table.  'show index'
+#   gives the indexes of a table in the order the server keeps them
+#   (the primary key, the unique indexes and the other indexes, each in
+#   the order they were made), which STATISTICS doesn't record.  MySQL
+#   5.7 and MariaDB make the rows of STATISTICS for each table in that
+#   order, so the indexes of each table are kept in the order they
+#   first appear, and the columns of each index are put in order of
+#   SEQ_IN_INDEX.  MySQL 8.0 doesn't promise any order for STATISTICS,
+#   so on it the indexes of a table with no primary key may come out
+#   in a different order from 'show index', which changes the order of
+#   those indexes in the schema documents.
+#
+# Cardinality is an estimate, and may be different each time it is
+# read, however it is read.  It is not used in the schema documents.
+
+columns_select = (
+    "select TABLE_NAME, COLUMN_NAME as `Field`, COLUMN_TYPE as `Type`,"
+    " IS_NULLABLE as `Null`, COLUMN_KEY as `Key`, COLUMN_DEFAULT as `Default`,"
+    " EXTRA as `Extra`"
+    " from information_schema.COLUMNS where TABLE_SCHEMA = database()"
+    " order by TABLE_NAME, ORDINAL_POSITION"
+)
+
+statistics_select = (
+    "select * from information_schema.STATISTICS where TABLE_SCHEMA = database()"
+)
+
+statistics_keys = {
+    'TABLE_NAME': 'Table',
+    'NON_UNIQUE': 'Non_unique',
+    'INDEX_NAME': 'Key_name',
+    'SEQ_IN_INDEX': 'Seq_in_index',
+    'COLUMN_NAME': 'Column_name',
+    'COLLATION': 'Collation',
+    'CARDINALITY': 'Cardinality',
+    'SUB_PART': 'Sub_part',
+    'PACKED': 'Packed',
+    'NULLABLE': 'Null',
+    'INDEX_TYPE': 'Index_type',
+    'COMMENT': 'Comment',
+    'INDEX_COMMENT': 'Index_comment',
+    'IGNORED': 'Ignored',
+    'IS_VISIBLE': 'Visible',
+    'EXPRESSION': 'Expression',
+}
+
+
+# Convert a default written as an SQL literal (as MariaDB, PostgreSQL
+# and SQLite give it) to the value 'describe' shows.
+
+
+def sql_default(value):
+    if value is not None and value.upper() == 'NULL':
+        return None
+    if value is not None and len(value) >= 2 and value[0] == value[-1] == "'":
+        return value[1:-1].replace("''", "'")
+    return value
+
+
+def bulk_schema(cursor, mariadb=False):
+    tables = [x[0] for x in select_rows(cursor, 'show tables')]
+    schema = {}
+    for table in tables:
+        schema[table] = ([], [])
+    for row in fetch_rows_as_list_of_dictionaries(cursor, columns_select):
+        table = row.pop('TABLE_NAME')
+        if mariadb:
+            row['Default'] = sql_default(row['Default'])
+        if table in schema:
+            schema[table][0].append(row)
+    indexes = {table: {} for table in tables}
+    for row in fetch_rows_as_list_of_dictionaries(cursor, statistics_select):
+        index = {}
+        for (key, value) in row.items():
+            if key.upper() in statistics_keys:
+                index[statistics_keys[key.upper()]] = value
+        if index['Table'] in indexes:
+            indexes[index['Table']].setdefault(index['Key_name'], []).append(index)
+    for (table, table_indexes) in indexes.items():
+        for rows in table_indexes.values():
+            rows.sort(key=lambda index: int(index['Seq_in_index']))
+            schema[table][1].extend(rows)
+    return schema
+
+
+# 2. Introspection backends.
+#
+# A backend reads the schema of one kind of database server.  It has:
+#
+#   name                  the name used to choose it (see backends);
+#   errors()              the exception classes its driver raises;
+#   connect(db_name)      connect to database db_name (for SQLite, the
+#                         path of the database file), or to the server
+#                         without choosing a database if db_name is None
+#                         and the backend allows it;
+#   select_db(db, name)   switch connection db to another database, or
+#                         return False if the backend can't;
+#   read_schema(db, bulk) the schema of the database, in the form
+#                         described above.
+#
+# Whatever the server, the rows are made to look like the rows from
+# MySQL's 'describe' and 'show index', with the keys that
+# get_schema.reduce_columns() and reduce_indexes() use, so the rest of
+# the code doesn't need to know where a schema came from.  The column
+# types are the server's own names for them, so schemas from different
+# kinds of server will differ in their types.
+#
+# The drivers are imported when they are first needed, so only the
+# driver for the backend in use has to be installed; SQLite needs none,
+# so a schema can be read and documented entirely in-process.
+
+
+# The 'Key' of each column in a 'describe' row: 'PRI' for a column of
+# the primary key, otherwise 'UNI' for the first column of a unique
+# index, 'MUL' for the first column of another index, or ''.
+
+
+def column_keys(indexes):
+    keys = {}
+    for i in indexes:
+        if i['Key_name'] == 'PRIMARY':
+            keys[i['Column_name']] = 'PRI'
+    for i in indexes:
+        c = i['Column_name']
+        if i['Seq_in_index'] == 1 and keys.get(c) != 'PRI':
+            if i['Non_unique'] == 0:
+                keys[c] = 'UNI'
+            elif c not in keys:
+                keys[c] = 'MUL'
+    return keys
+
+
+# Make a 'show index' row.
+
+
+def index_row(table, name, seq, column, unique, nullable, index_type):
+    return {
+        'Table': table,
+        'Non_unique': 0 if unique else 1,
+        'Key_name': name,
+        'Seq_in_index': seq,
+        'Column_name': column,
+        'Collation': 'A',
+        'Cardinality': None,
+        'Sub_part': None,
+        'Packed': None,
+        'Null': 'YES' if nullable else '',
+        'Index_type': index_type,
+        'Comment': '',
+        'Index_comment': '',
+    }
+
+
+# Make 'describe' rows, given (name, type, nullable, default, extra)
+# for each column and the 'show index' rows.
+
+
+def column_rows(columns, indexes):
+    keys = column_keys(indexes)
+    rows = []
+    for (name, sqltype, nullable, default, extra) in columns:
+        rows.append(
+            {
+                'Field': name,
+                'Type': sqltype,
+                'Null': 'YES' if nullable else 'NO',
+                'Key': keys.get(name, ''),
+                'Default': default,
+                'Extra': extra,
+            }
+        )
+    return rows
+
+
+class MySQLBackend:
+    name = 'mysql'
+
+    def driver(self):
+        import MySQLdb  # pylint: disable=import-outside-toplevel
+
+        return MySQLdb
+
+    def errors(self):
+        return (self.driver().Error,)
+
+    # Connect with the host and credentials from the [pickle_schema]
+    # section of ~/.my.cnf.
+
+    def connect(self, db_name=None):
+        default_file = os.path.expanduser('~/.my.cnf')
+        args = {
+            'read_default_file': default_file,
+            'read_default_group': 'pickle_schema',
+        }
+        if db_name is not None:
+            args['database'] = db_name
+        return self.driver().connect(**args)
+
+    def select_db(self, db, db_name):
+        db.select_db(db_name)
+        return True
+
+    def read_schema(self, db, bulk=False):
+        cursor = db.cursor()
+        try:
+            if bulk:
+                return bulk_schema(cursor, 'MariaDB' in db.get_server_info())
+            else:
+                return describe_schema(cursor)
+        finally:
+            cursor.close()
+
+
+# A PostgreSQL schema is read from the system catalogs, with one query
+# for the columns and one for the indexes, whatever 'bulk' is.  Column
+# types are as format_type() gives them (such as 'character
+# varying(255)'), and defaults have their type casts removed.  A column
+# whose default is the next value of a sequence, or which is an
+# identity column, is 'auto_increment' with no default, as in MySQL.
+# The primary key index is called 'PRIMARY', as in MySQL, and the index
+# type is the name of the access method ('BTREE', 'GIN', and so on).
+#
+# The connection parameters other than the database name come from the
+# environment and the usual PostgreSQL files [PostgreSQL].
+
+pg_columns_select = (
+    "select c.relname, a.attname, format_type(a.atttypid, a.atttypmod),"
+    " not a.attnotnull, pg_get_expr(d.adbin, d.adrelid), a.attidentity"
+    " from pg_attribute a"
+    " join pg_class c on c.oid = a.attrelid"
+    " join pg_namespace n on n.oid = c.relnamespace"
+    " left join pg_attrdef d on d.adrelid = a.attrelid and d.adnum = a.attnum"
+    " where n.nspname = current_schema() and c.relkind = 'r'"
+    " and a.attnum > 0 and not a.attisdropped"
+    " order by c.relname, a.attnum"
+)
+
+pg_indexes_select = (
+    "select t.relname, i.relname, x.indisprimary, x.indisunique, a.attname,"
+    " k.n, not a.attnotnull, upper(m.amname)"
+    " from pg_index x"
+    " join pg_class t on t.oid = x.indrelid"
+    " join pg_class i on i.oid = x.indexrelid"
+    " join pg_namespace n on n.oid = t.relnamespace"
+    " join pg_am m on m.oid = i.relam"
+    " cross join unnest(x.indkey) with ordinality as k(attnum, n)"
+    " join pg_attribute a on a.attrelid = t.oid and a.attnum = k.attnum"
+    " where n.nspname = current_schema() and t.relkind = 'r'"
+    " order by t.relname, x.indisprimary desc, i.relname, k.n"
+)
+
+pg_cast_re = re.compile(r"::[a-z_ ]+(\([0-9, ]+\))?(\[\])?$")
+
+
+def pg_default(expr):
+    if expr is None:
+        return None
+    while pg_cast_re.search(expr):
+        expr = pg_cast_re.sub('', expr)
+    return sql_default(expr)
+
+
+class PostgreSQLBackend:
+    name = 'postgresql'
+
+    def driver(self):
+        import psycopg2  # pylint: disable=import-outside-toplevel,import-error
+
+        return psycopg2
+
+    def errors(self):
+        return (self.driver().Error,)
+
+    def connect(self, db_name=None):
+        if db_name is None:
+            raise BzSchemaPickleException("PostgreSQL needs a database name.")
+        return self.driver().connect(dbname=db_name)
+
+    def select_db(self, db, db_name):
+        return False
+
+    def read_schema(self, db, bulk=False):
+        cursor = db.cursor()
+        try:
+            columns = {}
+            indexes = {}
+            for (table, *column) in select_rows(cursor, pg_columns_select):
+                columns.setdefault(table, []).append(column)
+                indexes.setdefault(table, [])
+            for row in select_rows(cursor, pg_indexes_select):
+                (table, name, primary, unique, column, seq, nullable, kind) = row
+                if primary:
+                    name = 'PRIMARY'
+                indexes[table].append(
+                    index_row(table, name, seq, column, unique, nullable, kind)
+                )
+        finally:
+            cursor.close()
+        schema = {}
+        for table in sorted(columns):
+            rows = []
+            for (name, sqltype, nullable, default, identity) in columns[table]:
+                extra = ''
+                if identity or (default or '').startswith('nextval('):
+                    (default, extra) = (None, 'auto_increment')
+                rows.append((name, sqltype, nullable, pg_default(default), extra))
+            schema[table] = (column_rows(rows, indexes[table]), indexes[table])
+        return schema
+
+
+# An SQLite schema is read with the table_info, index_list and
+# index_info pragmas for each table [SQLite].  That is 2N+1 statements
+# for N tables, but they don't go to a server.  The column types are
+# as they were declared, in lower case.  An 'integer primary key'
+# column is an alias for the rowid, so it has no index of its own: it
+# is given a 'PRIMARY' index, and is 'auto_increment'.  The index made
+# for any other primary key is also called 'PRIMARY'.
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def errors(self):
+        return (sqlite3.Error,)
+
+    def connect(self, db_name=None):
+        if db_name is None:
+            raise BzSchemaPickleException("SQLite needs a database file.")
+        if not os.path.exists(db_name):
+            raise BzSchemaPickleException("No SQLite database %s." % db_name)
+        return sqlite3.connect(db_name, check_same_thread=False)
+
+    def select_db(self, db, db_name):
+        return False
+
+    def read_schema(self, db, bulk=False):
+        cursor = db.cursor()
+        try:
+            tables = select_rows(
+                cursor,
+                "select name from sqlite_master where type = 'table'"
+                " and name not like 'sqlite\\_%' escape '\\' order by name",
+            )
+            schema = {}
+            for (table,) in tables:
+                schema[table] = self.read_table(cursor, table)
+            return schema
+        finally:
+            cursor.close()
+
+    def read_table(self, cursor, table):
+        quoted = '"%s"' % table.replace('"', '""')
+        info = select_rows(cursor, 'pragma table_info(%s)' % quoted)
+        pk = sorted((p, name) for (cid, name, t, notnull, d, p) in info if p)
+        rowid = len(pk) == 1 and any(
+            name == pk[0][1] and t.lower() == 'integer'
+            for (cid, name, t, notnull, d, p) in info
+        )
+        nullable = {name: not (notnull or p) for (cid, name, t, notnull, d, p) in info}
+        indexes = []
+        if rowid:
+            name = pk[0][1]
+            indexes.append(index_row(table, 'PRIMARY', 1, name, True, False, 'BTREE'))
+        for row in select_rows(cursor, 'pragma index_list(%s)' % quoted):
+            (index, unique, origin) = row[1:4]
+            key_name = 'PRIMARY' if origin == 'pk' else index
+            quoted_index = '"%s"' % index.replace('"', '""')
+            for (seqno, cid, column) in select_rows(
+                cursor, 'pragma index_info(%s)' % quoted_index
+            ):
+                indexes.append(
+                    index_row(
+                        table,
+                        key_name,
+                        seqno + 1,
+                        column,
+                        unique,
+                        nullable.get(column, True),
+                        'BTREE',
+                    )
+                )
+        indexes.sort(key=lambda i: i['Key_name'] != 'PRIMARY')
+        columns = []
+        for (cid, name, sqltype, notnull, default, p) in info:
+            extra = 'auto_increment' if rowid and name == pk[0][1] else ''
+            columns.append(
+                (name, sqltype.lower(), nullable[name], sql_default(default), extra)
+            )
+        return (column_rows(columns, indexes), indexes)
+
+
+backends = {
+    b.name: b for b in [MySQLBackend(), PostgreSQLBackend(), SQLiteBackend()]
+}
+
+DEFAULT_BACKEND = 'mysql'
+
+
+def get_backend(name):
+    if name not in backends:
+        raise BzSchemaPickleException(
+            "Unknown backend '%s': choose one of %s."
+            % (name, str.join(', ', sorted(backends)))
+        )
+    return backends[name]
+
+
+# 3. Making pickles.
+#
+# Write the pickle for a schema.  The file is replaced atomically, so
+# that nothing ever sees part of a pickle.
+
+
+def write_pickle(schema_version, schema):
+    path = 'pickles/%s' % schema_version
+    (fd, temp) = tempfile.mkstemp(dir='pickles', prefix='.' + schema_version)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((schema_version, schema), f)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+# Read the schema of the database db_name with a backend.  For MySQL,
+# if 'bulk' is true, the schema is read with bulk_schema(), otherwise
+# with describe_schema().
+
+
+def read_schema(db_name, bulk=False, backend=DEFAULT_BACKEND):
+    backend = get_backend(backend)
+    db = backend.connect(db_name)
+    try:
+        return backend.read_schema(db, bulk)
+    finally:
+        db.close()
+
+
+# Make a pickle of the schema of the database db_name, for Bugzilla
+# version schema_version.
+
+
+def pickle_schema(schema_version, db_name, bulk=False, backend=DEFAULT_BACKEND):
+    write_pickle(schema_version, read_schema(db_name, bulk, backend))
+
+
+# 4. Making many pickles at once.
+#
+# pickle_schemas() makes the pickles for many versions at once, from a
+# manifest mapping each Bugzilla version to the name of the database
+# holding its schema: for instance, when all the pickles have to be
+# made again.  A manifest file is a JSON object, such as
+#
+#   {"5.0": "bugs_5_0", "5.2": "bugs_5_2"}
+#
+# The schemas are read by 'jobs' threads, which share a pool of at most
+# 'jobs' connections to the server.  With MySQL, each thread selects the
+# database it needs on a connection from the pool; with the other
+# backends, each database has its own connection.  Each pickle is
+# written as soon as its schema has been read.
+
+
+def read_manifest(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if not isinstance(manifest, dict) or not all(
+        isinstance(v, str) and isinstance(d, str) for (v, d) in manifest.items()
+    ):
+        raise BzSchemaPickleException(
+            "The manifest %s should map each version to a database name." % path
+        )
+    return manifest
+
+
+# A ConnectionPool hands out at most 'size' connections at once, each
+# to one thread, connected to the database it asks for.  Connections
+# which are given back are kept and used again if the backend can
+# switch them to another database; a connection is only made when there
+# is none to use again, so there are never more than 'size' of them.  A
+# connection which has failed is closed rather than given back.
+
+
+class ConnectionPool:
+    def __init__(self, backend, size):
+        self.backend = backend
+        self.slots = threading.BoundedSemaphore(size)
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def get(self, db_name):
+        self.slots.acquire()
+        try:
+            with self.lock:
+                db = self.idle.pop() if self.idle else None
+            if db is not None:
+                try:
+                    switched = self.backend.select_db(db, db_name)
+                except BaseException:
+                    self.close_connection(db)
+                    raise
+                if switched:
+                    return db
+                self.close_connection(db)
+            return self.backend.connect(db_name)
+        except BaseException:
+            self.slots.release()
+            raise
+
+    def put(self, db):
+        with self.lock:
+            self.idle.append(db)
+        self.slots.release()
+
+    def discard(self, db):
+        self.close_connection(db)
+        self.slots.release()
+
+    def close_connection(self, db):
+        try:
+            db.close()
+        except self.backend.errors():
+            pass
+
+    def close(self):
+        with self.lock:
+            (idle, self.idle) = (self.idle, [])
+        for db in idle:
+            self.close_connection(db)
+
+
+def pickle_from_pool(pool, schema_version, db_name, bulk):
+    db = pool.get(db_name)
+    try:
+        schema = pool.backend.read_schema(db, bulk)
+    except BaseException:
+        pool.discard(db)
+        raise
+    pool.put(db)
+    write_pickle(schema_version, schema)
+
+
+# Make the pickles for a manifest, calling progress(version, error) as
+# each is done; error is None if the pickle was made, and otherwise a
+# message saying why not.  Returns a map from version to error message
+# for the versions whose pickles could not be made.
+
+PICKLE_JOBS = 4
+
+
+def pickle_schemas(
+    manifest, jobs=PICKLE_JOBS, bulk=False, progress=None, backend=DEFAULT_BACKEND
+):
+    backend = get_backend(backend)
+    pool = ConnectionPool(backend, jobs)
+    failed = {}
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {
+                executor.submit(pickle_from_pool, pool, version, db_name, bulk): version
+                for (version, db_name) in manifest.items()
+            }
+            for future in concurrent.futures.as_completed(futures):
+                version = futures[future]
+                try:
+                    future.result()
+                    error = None
+                except backend.errors() + (BzSchemaPickleException, OSError) as e:
+                    error = str(e)
+                    failed[version] = error
+                if progress is not None:
+                    progress(version, error)
+    finally:
+        pool.close()
+    return failed
 
 
 # A. REFERENCES
 #
+# [MariaDB] "Information Schema COLUMNS Table"; MariaDB Foundation;
+# <https://mariadb.com/kb/en/information-schema-columns-table/>.
+#
+# [MySQL] "MySQL 8.0 Reference Manual", "INFORMATION_SCHEMA
+# Tables"; Oracle Corporation;
+# <https://dev.mysql.com/doc/refman/8.0/en/information-schema.html>.
+#
+# [PostgreSQL] "PostgreSQL Documentation", "libpq - C Library";
+# The PostgreSQL Global Development Group;
+# <https://www.postgresql.org/docs/current/libpq.html>.
+#
+# [SQLite] "Pragma statements supported by SQLite"; SQLite;
+# <https://www.sqlite.org/pragma.html>.
+#
 #
 # B. DOCUMENT HISTORY
 #
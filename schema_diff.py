@@ -0,0 +1,288 @@
+#             Perforce Defect Tracking Integration Project
+#              <http://www.ravenbrook.com/project/p4dti/>
+#
+#           SCHEMA_DIFF.PY -- MACHINE-READABLE SCHEMA DIFFERENCES
+#
+#
+# 1. INTRODUCTION
+#
+# This module compares the schemas of a range of Bugzilla versions,
+# and describes the tables, columns and indexes which were added,
+# removed or changed in that range, as JSON [RFC 8259], for programs
+# (such as upgrade tools) which would otherwise have to read the HTML
+# documents.  It is used by the 'diff' action of index.py and by
+# 'schema-tool diff'.
+#
+# The differences come from the versioned schema made by
+# make_schema_doc.versioned_schema(), before it is annotated, so none
+# of the remarks are included.
+#
+# The intended readership is project developers.
+#
+# This document is not confidential.
+
+import json
+
+import make_schema_doc
+import lazy_remarks as schema_remarks
+
+# 2. The diff.
+#
+# The diff is a dictionary with these keys:
+#
+# format   DIFF_FORMAT;
+# first    the first Bugzilla version of the range;
+# last     the last Bugzilla version of the range;
+# schemas  a list of dictionaries {'version': v, 'schema': s}, one for
+#          each Bugzilla version v in the range in which the schema
+#          changes (and the first), where s is the name of its schema;
+# tables   a dictionary mapping the name of each table which changes in
+#          the range to a description of its changes (see below).
+#
+# The description of a table, column or index is a dictionary with
+# these keys:
+#
+# status    'added' (absent at the start of the range and present at
+#           the end), 'removed' (the reverse), or 'changed' (anything
+#           else which changes in the range);
+# presence  a list of dictionaries {'version': v, 'change': c}, where c
+#           is 'added' or 'removed', for each Bugzilla version v in the
+#           range in which it was added or removed;
+# history   (for columns and indexes) a dictionary mapping each
+#           attribute (see column_attributes and index_attributes) to a
+#           list of pairs [v, value], for each Bugzilla version v in
+#           which the attribute takes a new value.
+#
+# The description of a table also has the keys 'columns' and
+# 'indexes', mapping the name of each column or index to its
+# description.  For a table which was added or removed, all its
+# columns and indexes are given (their presence is relative to the
+# table's); for other tables, only those which change.
+
+DIFF_FORMAT = 1
+
+column_attributes = ['Name', 'Type', 'Default', 'Properties']
+index_attributes = ['Name', 'Fields', 'Properties']
+
+
+# Return the pair (status, presence) for something whose presence mask
+# is 'mask', within the presence mask 'within' of its parent (for a
+# table, the mask of all the schemas), where 'bzs' are the Bugzilla
+# versions to which the masks refer.  The status is None if its
+# presence doesn't change.
+
+
+def presence(mask, within, bzs):
+    changes = make_schema_doc.presence_changes(mask, within)
+    events = []
+    for i in make_schema_doc.mask_bits(changes):
+        events.append(
+            {'version': bzs[i], 'change': 'added' if mask & (1 << i) else 'removed'}
+        )
+    first = within & -within
+    last = 1 << (within.bit_length() - 1)
+    if mask & last and not mask & first:
+        status = 'added'
+    elif mask & first and not mask & last:
+        status = 'removed'
+    elif events:
+        status = 'changed'
+    else:
+        status = None
+    return (status, events)
+
+
+# Describe a column or index from its record in the versioned schema,
+# returning None if it doesn't change and 'complete' is false.
+
+
+def describe_item(record, attributes, within, bzs, complete):
+    (status, events) = presence(record['versions'], within, bzs)
+    history = {}
+    for k in attributes:
+        history[k] = [
+            [bz, value] for (bz, value) in make_schema_doc.reduce_pair_list(record[k])
+        ]
+        if status is None and len(history[k]) > 1:
+            status = 'changed'
+    if status is None:
+        if not complete:
+            return None
+        status = 'unchanged'
+    return {'status': status, 'presence': events, 'history': history}
+
+
+def describe_items(records, attributes, within, bzs, complete):
+    items = {}
+    for (name, record) in records.items():
+        item = describe_item(record, attributes, within, bzs, complete)
+        if item is not None:
+            items[name] = item
+    return items
+
+
+# Describe a table from its entry in the versioned schema, returning
+# None if it doesn't change.
+
+
+def describe_table(entry, bzs):
+    (mask, columns, indexes) = entry
+    everything = (1 << len(bzs)) - 1
+    (status, events) = presence(mask, everything, bzs)
+    complete = status in ('added', 'removed')
+    columns = describe_items(columns, column_attributes, mask, bzs, complete)
+    indexes = describe_items(indexes, index_attributes, mask, bzs, complete)
+    if status is None:
+        if not columns and not indexes:
+            return None
+        status = 'changed'
+    return {
+        'status': status,
+        'presence': events,
+        'columns': columns,
+        'indexes': indexes,
+    }
+
+
+# 3. Making the diff.
+#
+# schema_diff() returns the diff from 'first' to 'last', as for
+# make_schema_doc.stream_tables(): if 'tables' is given, only those
+# tables are compared, and if 'ctx' is given, the work is done in that
+# RenderContext.  It raises BzSchemaProcessingException if the schemas
+# have errors.
+
+
+def schema_diff(first, last, tables=None, ctx=None):
+    if ctx is None:
+        ctx = make_schema_doc.RenderContext()
+    (bzs, schema) = make_schema_doc.versioned_schema(first, last, ctx, tables)
+    described = {}
+    with ctx.phase('diff'):
+        for (t, entry) in schema.items():
+            table = describe_table(entry, bzs)
+            if table is not None:
+                described[t] = table
+    for table in described.values():
+        ctx.count('tables')
+        ctx.count('columns', len(table['columns']))
+        ctx.count('indexes', len(table['indexes']))
+    return {
+        'format': DIFF_FORMAT,
+        'first': first,
+        'last': last,
+        'schemas': [
+            {'version': bz, 'schema': schema_remarks.version_schema_map[bz]}
+            for bz in bzs
+        ],
+        'tables': described,
+    }
+
+
+# diff_chunks() returns an iterator over the text of the diff as JSON,
+# one table at a time, so that it can be written out as it goes.  The
+# whole diff is made by schema_diff() before diff_chunks() returns, so
+# any errors in the schemas are raised then; the iterator only encodes
+# the tables of the diff, which are plain lists, dictionaries and
+# strings.
+
+
+def diff_chunks(first, last, tables=None, ctx=None):
+    diff = schema_diff(first, last, tables, ctx)
+    return json_chunks(diff, ctx)
+
+
+def json_chunks(diff, ctx=None):
+    head = {k: v for (k, v) in diff.items() if k != 'tables'}
+    chunk = json.dumps(head, separators=(',', ':'))[:-1] + ',"tables":{'
+    yield chunk
+    separator = ''
+    for (name, table) in diff['tables'].items():
+        chunk = separator + json.dumps(name) + ':'
+        chunk += json.dumps(table, separators=(',', ':'))
+        if ctx is not None:
+            ctx.count('characters', len(chunk))
+        yield chunk
+        separator = ','
+    yield '}}\n'
+
+
+# 4. Summarizing the diff.
+#
+# summary_lines() returns a list of lines describing the diff for
+# people, as printed by 'schema-tool diff'.
+
+
+def item_changes(item):
+    changes = []
+    for event in item['presence']:
+        changes.append('%s in %s' % (event['change'], event['version']))
+    for (k, history) in item.get('history', {}).items():
+        for (bz, value) in history[1:]:
+            changes.append('%s %s in %s' % (k, value, bz))
+    return str.join('; ', changes)
+
+
+def summary_lines(diff):
+    lines = ['Schema changes from %s to %s:' % (diff['first'], diff['last'])]
+    if not diff['tables']:
+        lines.append('  none')
+    for (name, table) in diff['tables'].items():
+        lines.append('  table %s: %s' % (name, table['status']))
+        changes = item_changes(table)
+        if changes:
+            lines.append('    ' + changes)
+        for (kind, label) in [('columns', 'column'), ('indexes', 'index')]:
+            for (item_name, item) in table[kind].items():
+                line = '    %s %s: %s' % (label, item_name, item['status'])
+                changes = item_changes(item)
+                if changes:
+                    line += ' (%s)' % changes
+                lines.append(line)
+    return lines
+
+
+# A. REFERENCES
+#
+# [RFC 8259] "The JavaScript Object Notation (JSON) Data Interchange
+# Format"; T. Bray; IETF; 2017-12;
+# <https://www.rfc-editor.org/rfc/rfc8259>.
+#
+#
+# B. DOCUMENT HISTORY
+#
+# 2026-10-18 AG  Created.
+#
+#
+# C. COPYRIGHT AND LICENSE
+#
+# This file is copyright (c) 2026 Bugzilla Project Contributors. All rights
+# reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# 1.  Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+# 2.  Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDERS AND CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+#
+# $Id$
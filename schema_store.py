@@ -0,0 +1,375 @@
+#             Perforce Defect Tracking Integration Project
+#              <http://www.ravenbrook.com/project/p4dti/>
+#
+#       SCHEMA_STORE.PY -- A COMPACT STORE OF ALL THE BUGZILLA SCHEMAS
+#
+#
+# 1. INTRODUCTION
+#
+# This module reads and writes the schema store: a single binary file,
+# 'schema_store.bin' next to the 'pickles' directory, holding the
+# schemas from all the pickles made by pickle_schema.py.
+#
+# Only the parts of the 'describe' and 'show index' output which
+# get_schema.py uses are kept, every string is stored once, and a
+# table which is the same in several schemas is stored once.  The file
+# is mapped into memory, and a table is only decoded when it is asked
+# for, so reading a schema from the store is much cheaper than
+# unpickling it, and doesn't involve unpickling anything.
+#
+# get_schema.py reads a schema from the store if it is there, and from
+# its pickle otherwise.  Run 'schema-tool store' to rebuild the store
+# after adding or changing a pickle.
+#
+# The intended readership is project developers.
+#
+# This document is not confidential.
+
+import mmap
+import os
+import pickle
+import struct
+import sys
+import tempfile
+import threading
+
+# 2. The file format.
+#
+# All numbers are unsigned 32-bit little-endian integers.  The file
+# starts with a header:
+#
+#   magic                 b'BZSCHEMA'
+#   format                STORE_FORMAT
+#   string count, block count, schema count
+#   offsets of the string, block and schema sections
+#
+# String section: (string count + 1) offsets into the string data,
+# followed by the UTF-8 string data.  Strings are referred to by their
+# number.
+#
+# Block section: (block count + 1) offsets, relative to the end of the
+# offsets, of the blocks.  A block is one table: the number of column
+# rows, the number of index rows, then the rows.  A column row is the
+# strings for the COLUMN_KEYS; an index row is the values for the
+# INDEX_KEYS, which are strings except for 'Seq_in_index' and
+# 'Non_unique'.
+#
+# Schema section: for each schema, the string number of its name, the
+# number of tables, and the offset of its table list.  After that come
+# the table lists, which are pairs of (table name string, block
+# number); the offsets are relative to the start of the first list.
+#
+# NONE stands for a value of None, and ABSENT for a key which is not in
+# a row at all.
+
+STORE_FILE = 'schema_store.bin'
+MAGIC = b'BZSCHEMA'
+STORE_FORMAT = 1
+
+NONE = 0xFFFFFFFF
+ABSENT = 0xFFFFFFFE
+
+COLUMN_KEYS = ['Field', 'Type', 'Null', 'Extra', 'Default']
+INDEX_KEYS = [
+    'Key_name',
+    'Seq_in_index',
+    'Column_name',
+    'Non_unique',
+    'Index_type',
+    'Comment',
+]
+INDEX_INTEGER_KEYS = ['Seq_in_index', 'Non_unique']
+
+header_struct = struct.Struct('<8s7I')
+
+
+class BzSchemaStoreException(Exception):
+    def __init__(self, message):
+        super().__init__(message)
+        self.message = message
+
+    def __str__(self):
+        return self.message
+
+
+def store_path():
+    return os.path.join(os.path.dirname(os.path.abspath('pickles')), STORE_FILE)
+
+
+# 3. Writing the store.
+
+
+class StoreWriter:
+    def __init__(self):
+        self.strings = []
+        self.string_numbers = {}
+        self.blocks = []
+        self.block_numbers = {}
+        self.schemas = []
+
+    def string(self, s):
+        if s is None:
+            return NONE
+        if s not in self.string_numbers:
+            self.string_numbers[s] = len(self.strings)
+            self.strings.append(s)
+        return self.string_numbers[s]
+
+    def value(self, row, key, integer):
+        if key not in row:
+            return ABSENT
+        if integer:
+            return int(row[key])
+        return self.string(row[key])
+
+    def block(self, columns, indexes):
+        words = [len(columns), len(indexes)]
+        for row in columns:
+            words.extend(self.value(row, k, False) for k in COLUMN_KEYS)
+        for row in indexes:
+            words.extend(
+                self.value(row, k, k in INDEX_INTEGER_KEYS) for k in INDEX_KEYS
+            )
+        block = struct.pack('<%dI' % len(words), *words)
+        if block not in self.block_numbers:
+            self.block_numbers[block] = len(self.blocks)
+            self.blocks.append(block)
+        return self.block_numbers[block]
+
+    def add_schema(self, name, schema):
+        tables = []
+        for (table, (columns, indexes)) in schema.items():
+            tables.append((self.string(table), self.block(columns, indexes)))
+        self.schemas.append((self.string(name), tables))
+
+    def data(self):
+        encoded = [s.encode('utf-8') for s in self.strings]
+        offsets = [0]
+        for e in encoded:
+            offsets.append(offsets[-1] + len(e))
+        string_section = struct.pack('<%dI' % len(offsets), *offsets) + b''.join(
+            encoded
+        )
+        offsets = [0]
+        for b in self.blocks:
+            offsets.append(offsets[-1] + len(b))
+        block_section = struct.pack('<%dI' % len(offsets), *offsets) + b''.join(
+            self.blocks
+        )
+        heads = []
+        lists = []
+        offset = 0
+        for (name, tables) in self.schemas:
+            heads.extend([name, len(tables), offset])
+            for pair in tables:
+                lists.extend(pair)
+            offset += 8 * len(tables)
+        schema_section = struct.pack('<%dI' % len(heads), *heads) + struct.pack(
+            '<%dI' % len(lists), *lists
+        )
+        string_offset = header_struct.size
+        block_offset = string_offset + len(string_section)
+        schema_offset = block_offset + len(block_section)
+        header = header_struct.pack(
+            MAGIC,
+            STORE_FORMAT,
+            len(self.strings),
+            len(self.blocks),
+            len(self.schemas),
+            string_offset,
+            block_offset,
+            schema_offset,
+        )
+        return header + string_section + block_section + schema_section
+
+
+# Convert all the pickles in the 'pickles' directory into a store,
+# returning the names of the schemas.  The file is replaced atomically,
+# so that a running server never sees part of it.
+
+
+def write_store():
+    writer = StoreWriter()
+    names = sorted(os.listdir('pickles'))
+    for name in names:
+        with open('pickles/%s' % name, 'rb') as f:
+            (sv, schema) = pickle.load(f)
+        writer.add_schema(name, schema)
+    path = store_path()
+    (fd, temp) = tempfile.mkstemp(dir=os.path.dirname(path), prefix=STORE_FILE)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(writer.data())
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+    return names
+
+
+# 4. Reading the store.
+#
+# A SchemaStore maps the store file into memory.  schema_names() lists
+# the schemas in it, tables() lists the tables in a schema, and table()
+# decodes one table, returning the (columns, indexes) lists of row
+# dictionaries in the form get_schema.reduce_columns() and
+# reduce_indexes() expect.
+
+
+class SchemaStore:
+    def __init__(self, path, key):
+        self.key = key
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        words = memoryview(self.map)
+        (
+            magic,
+            store_format,
+            n_strings,
+            n_blocks,
+            n_schemas,
+            string_offset,
+            block_offset,
+            schema_offset,
+        ) = header_struct.unpack_from(self.map, 0)
+        if magic != MAGIC or store_format != STORE_FORMAT:
+            raise BzSchemaStoreException("%s is not a schema store." % path)
+        self.string_offsets = words[
+            string_offset : string_offset + 4 * (n_strings + 1)
+        ].cast('I')
+        self.string_data = string_offset + 4 * (n_strings + 1)
+        self.block_offsets = words[
+            block_offset : block_offset + 4 * (n_blocks + 1)
+        ].cast('I')
+        self.block_data = block_offset + 4 * (n_blocks + 1)
+        self.words = words
+        self.string_cache = [None] * n_strings
+        heads = words[schema_offset : schema_offset + 12 * n_schemas].cast('I')
+        lists = schema_offset + 12 * n_schemas
+        self.schemas = {}
+        for i in range(n_schemas):
+            (name, n_tables, offset) = heads[3 * i : 3 * i + 3]
+            self.schemas[self.string(name)] = (lists + offset, n_tables)
+
+    def string(self, n):
+        s = self.string_cache[n]
+        if s is None:
+            start = self.string_data + self.string_offsets[n]
+            end = self.string_data + self.string_offsets[n + 1]
+            s = str(self.map[start:end], 'utf-8')
+            self.string_cache[n] = s
+        return s
+
+    def schema_names(self):
+        return list(self.schemas.keys())
+
+    def has_schema(self, name):
+        return name in self.schemas
+
+    # Return a map from table name to block number for a schema.
+    def tables(self, name):
+        offset, n_tables = self.schemas[name]
+        pairs = self.words[offset : offset + 8 * n_tables].cast('I')
+        return {self.string(pairs[2 * i]): pairs[2 * i + 1] for i in range(n_tables)}
+
+    def value(self, word, integer):
+        if word == NONE:
+            return None
+        if integer:
+            return word
+        return self.string(word)
+
+    def rows(self, words, count, keys, integer_keys):
+        rows = []
+        width = len(keys)
+        integer = [key in integer_keys for key in keys]
+        for r in range(0, count * width, width):
+            row = {}
+            for k in range(width):
+                word = words[r + k]
+                if word != ABSENT:
+                    row[keys[k]] = self.value(word, integer[k])
+            rows.append(row)
+        return rows
+
+    # Decode a block, given its number.
+    def table(self, block):
+        start = self.block_data + self.block_offsets[block]
+        end = self.block_data + self.block_offsets[block + 1]
+        words = self.words[start:end].cast('I').tolist()
+        (n_columns, n_indexes) = words[0:2]
+        split = 2 + n_columns * len(COLUMN_KEYS)
+        columns = self.rows(words[2:split], n_columns, COLUMN_KEYS, [])
+        indexes = self.rows(words[split:], n_indexes, INDEX_KEYS, INDEX_INTEGER_KEYS)
+        return (columns, indexes)
+
+
+# The store for this process, opened on first use and opened again if
+# the file changes.  get_store() returns None if there is no store, or
+# if the platform is big-endian, as the store is read by casting it to
+# native unsigned integers.
+
+store = None
+store_lock = threading.Lock()
+
+
+def store_key():
+    try:
+        st = os.stat(store_path())
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+def get_store():
+    global store
+    with store_lock:
+        key = store_key()
+        if key is None or sys.byteorder != 'little':
+            store = None
+        elif store is None or store.key != key:
+            store = SchemaStore(store_path(), key)
+        return store
+
+
+# A. REFERENCES
+#
+#
+# B. DOCUMENT HISTORY
+#
+# 2026-10-18 AG  Created.
+#
+#
+# C. COPYRIGHT AND LICENSE
+#
+# This file is copyright (c) 2026 Bugzilla Project Contributors. All rights
+# reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# 1.  Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+# 2.  Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDERS AND CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+#
+# $Id$
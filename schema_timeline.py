@@ -0,0 +1,487 @@
+#             Perforce Defect Tracking Integration Project
+#              <http://www.ravenbrook.com/project/p4dti/>
+#
+#        SCHEMA_TIMELINE.PY -- THE HISTORY OF EVERY BUGZILLA SCHEMA
+#
+#
+# 1. INTRODUCTION
+#
+# This module builds a timeline of the Bugzilla schema: a single
+# structure recording, for every table, column and index which appears
+# in any schema, the schemas in which it appears and every change to
+# its fields.  The versioned schema for any range of Bugzilla versions
+# can be sliced out of the timeline (see versioned_tables()), instead
+# of being built up from the schemas for every version in the range.
+#
+# The timeline is saved by 'schema-tool timeline' (and 'schema-tool
+# store') in the file 'schema_timeline.bin', next to the 'pickles'
+# directory.  It is saved using marshal [Python], not pickle, so that
+# loading it can't run any code.  The saved timeline is out of date if
+# the schema store, any pickle which is not in the store,
+# schema_remarks.py or the code which reduces the schemas has changed.
+# The offline tools then build the timeline for themselves.  The web
+# interface never builds or saves it: it reads the schemas instead
+# (see make_schema_doc.versioned_schema()).
+#
+# The intended readership is project developers.
+#
+# This document is not confidential.
+
+import collections
+import marshal
+import os
+import tempfile
+import threading
+
+import get_schema
+import metrics
+import lazy_remarks as schema_remarks
+import schema_store
+
+# 2. The timeline.
+#
+# The schemas are numbered by their "position": each position is a run
+# of consecutive Bugzilla versions (in schema_remarks.version_order)
+# which have the same schema.  A timeline has these fields:
+#
+# key:          identifies the files it was built from (see
+#               timeline_key());
+# versions:     for each position, the first Bugzilla version in it;
+# schema_names: for each position, the name of its schema;
+# positions:    map from Bugzilla version to position;
+# errors:       for each position, a tuple of the errors found when
+#               reducing its schema;
+# table_orders: for each position, a tuple of the names of the tables
+#               in its schema, in order;
+# tables:       map from table name to a TableHistory.
+#
+# A TableHistory has these fields:
+#
+# versions:       a bitmask of the positions in which the table is
+#                 present;
+# columns:        map from column name to a History;
+# indexes:        map from index name to a History;
+# column_orders:  for each position, a tuple of the names of the
+#                 columns in the table, in order, or None if the table
+#                 is not present;
+# index_orders:   the same for the indexes.
+#
+# The order of tables, columns and indexes in the schemas decides the
+# order in which errors are reported, and the order of indexes in the
+# document when a table has no primary key, so it is kept.  The order
+# hardly ever changes, so when the order at a position is the same as
+# at the previous one, the same tuple is used for both.
+#
+# A History has these fields:
+#
+# versions:  a bitmask of the positions in which it is present;
+# changes:   a map from each field of the Column or Index (see
+#            get_schema.py) to a tuple of (position, value) pairs, one
+#            for the first position in which it is present and one for
+#            each later position in which the value is different;
+# Remarks:   the tuple of remarks from the Column or Index.
+
+TIMELINE_FILE = 'schema_timeline.bin'
+
+# Increase this when the structure of the timeline changes.
+TIMELINE_FORMAT = 2
+
+COLUMN_FIELDS = ['Name', 'Default', 'Type', 'Properties']
+INDEX_FIELDS = ['Name', 'Fields', 'Properties']
+
+Timeline = collections.namedtuple(
+    'Timeline',
+    [
+        'key',
+        'versions',
+        'schema_names',
+        'positions',
+        'errors',
+        'table_orders',
+        'tables',
+    ],
+)
+
+TableHistory = collections.namedtuple(
+    'TableHistory', ['versions', 'columns', 'indexes', 'column_orders', 'index_orders']
+)
+
+History = collections.namedtuple('History', ['versions', 'changes', 'Remarks'])
+
+
+# The key of a timeline identifies the files it depends on, by their
+# modification times and sizes.  The timeline is checked on every call
+# to get_timeline(), so as few files as possible are looked at: the
+# key of the schema store (see schema_store.get_store()) stands for all
+# the schemas in it, as it does for the schema caches in get_schema.py,
+# and only the pickles of schemas which are not in the store are
+# looked at.
+
+
+def file_key(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return (path, None, None)
+    return (path, st.st_mtime_ns, st.st_size)
+
+
+def timeline_key():
+    key = [TIMELINE_FORMAT]
+    for path in [schema_remarks.source_path(), get_schema.__file__, __file__]:
+        key.append(file_key(path))
+    store = schema_store.get_store()
+    key.append(None if store is None else store.key)
+    for name in sorted(set(schema_remarks.version_schema_map.values())):
+        if store is None or not store.has_schema(name):
+            key.append(file_key(get_schema.pickle_path(name)))
+    return tuple(key)
+
+
+# Add the columns or indexes from the schema at a position to a map of
+# histories.  While the timeline is being built, a history is a list
+# [versions, changes, Remarks] with a list of pairs for each field.
+
+
+def add_histories(histories, records, fields, pos):
+    for name, record in records.items():
+        if name not in histories:
+            histories[name] = [0, {k: [] for k in fields}, record.Remarks]
+        history = histories[name]
+        history[0] |= 1 << pos
+        for k in fields:
+            value = getattr(record, k)
+            changes = history[1][k]
+            if not changes or changes[-1][1] != value:
+                changes.append((pos, value))
+        history[2] = record.Remarks
+
+
+# Add the order of some names at a position to a list of orders, using
+# the previous order if it is the same.
+
+
+def add_order(orders, names, pos):
+    order = tuple(names)
+    while len(orders) < pos:
+        orders.append(None)
+    for previous in reversed(orders):
+        if previous is not None:
+            if previous == order:
+                order = previous
+            break
+    orders.append(order)
+
+
+def freeze_histories(histories):
+    return {
+        name: History(versions, {k: tuple(pl) for (k, pl) in changes.items()}, remarks)
+        for (name, (versions, changes, remarks)) in histories.items()
+    }
+
+
+def build_timeline(key):
+    versions = []
+    schema_names = []
+    positions = {}
+    for v in schema_remarks.version_order:
+        if v not in schema_remarks.version_schema_map:
+            continue
+        name = schema_remarks.version_schema_map[v]
+        if not schema_names or name != schema_names[-1]:
+            versions.append(v)
+            schema_names.append(name)
+        positions[v] = len(versions) - 1
+    errors = []
+    table_orders = []
+    tables = {}
+    for (pos, name) in enumerate(schema_names):
+        (schema, schema_errors) = get_schema.get_schema(name, [])
+        errors.append(tuple(schema_errors))
+        add_order(table_orders, schema.keys(), pos)
+        for t, (cols, inds) in schema.items():
+            if t not in tables:
+                tables[t] = [0, {}, {}, [], []]
+            tables[t][0] |= 1 << pos
+            add_histories(tables[t][1], cols, COLUMN_FIELDS, pos)
+            add_histories(tables[t][2], inds, INDEX_FIELDS, pos)
+            add_order(tables[t][3], cols.keys(), pos)
+            add_order(tables[t][4], inds.keys(), pos)
+    for t in list(tables.keys()):
+        (v, cols, inds, column_orders, index_orders) = tables[t]
+        column_orders += [None] * (len(schema_names) - len(column_orders))
+        index_orders += [None] * (len(schema_names) - len(index_orders))
+        tables[t] = TableHistory(
+            v,
+            freeze_histories(cols),
+            freeze_histories(inds),
+            tuple(column_orders),
+            tuple(index_orders),
+        )
+    return Timeline(
+        key,
+        tuple(versions),
+        tuple(schema_names),
+        positions,
+        tuple(errors),
+        tuple(table_orders),
+        tables,
+    )
+
+
+# 3. Saving and loading the timeline.
+#
+# marshal only handles built-in types, so the timeline is saved with
+# its named tuples as plain tuples (see timeline_data()), and they are
+# made again when it is loaded (see data_timeline()).  The orders which
+# are the same object at several positions are still the same object
+# when loaded.
+
+
+def timeline_path():
+    return os.path.join(
+        os.path.dirname(os.path.abspath(get_schema.pickle_path(''))), TIMELINE_FILE
+    )
+
+
+def histories_data(histories):
+    return {name: tuple(history) for (name, history) in histories.items()}
+
+
+def timeline_data(timeline):
+    tables = {}
+    for (t, history) in timeline.tables.items():
+        tables[t] = (
+            history.versions,
+            histories_data(history.columns),
+            histories_data(history.indexes),
+            history.column_orders,
+            history.index_orders,
+        )
+    return tuple(timeline[:-1]) + (tables,)
+
+
+def data_histories(data):
+    return {name: History(*history) for (name, history) in data.items()}
+
+
+def data_timeline(data):
+    tables = {}
+    for (t, (v, columns, indexes, column_orders, index_orders)) in data[-1].items():
+        tables[t] = TableHistory(
+            v,
+            data_histories(columns),
+            data_histories(indexes),
+            column_orders,
+            index_orders,
+        )
+    return Timeline(*data[:-1], tables)
+
+
+# Load the saved timeline, returning None if it is missing or out of
+# date.
+
+
+def load_timeline(key):
+    try:
+        with open(timeline_path(), 'rb') as f:
+            data = marshal.loads(f.read())
+    except Exception:
+        return None
+    if not isinstance(data, tuple) or len(data) != len(Timeline._fields):
+        return None
+    if data[0] != key:
+        return None
+    return data_timeline(data)
+
+
+# Save the timeline.  The file is replaced atomically, so that another
+# process never sees part of it.
+
+
+def save_timeline(timeline):
+    path = timeline_path()
+    (fd, temp) = tempfile.mkstemp(dir=os.path.dirname(path), prefix=TIMELINE_FILE)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            marshal.dump(timeline_data(timeline), f)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+# The timeline for this process.  It is checked against the files on
+# every call to get_timeline(), and built or loaded again if they have
+# changed.  A timeline which had to be built is only saved if 'save' is
+# true, as it is by schema-tool and the other offline tools.  If
+# 'build' is false and the timeline is neither in memory nor saved, up
+# to date, get_timeline() returns None instead of building it; the web
+# interface does this (see make_schema_doc.versioned_schema()), as
+# building the timeline takes longer than reading the schemas for any
+# one document.  If 'count' is given, count('timeline_cached'),
+# count('timeline_loaded') or count('timeline_built') is called,
+# depending on how the timeline was got.  The service's metrics (see
+# metrics.py) count the same.
+
+timeline = None
+timeline_lock = threading.Lock()
+use_saved_timeline = True
+timeline_gets = metrics.counter(
+    'timeline_gets', 'Gets of the schema timeline, by how it was got.', ['how']
+)
+
+
+def get_timeline(count=None, save=False, build=True):
+    global timeline
+    with timeline_lock:
+        key = timeline_key()
+        how = 'timeline_cached'
+        if timeline is None or timeline.key != key:
+            timeline = None
+            how = 'timeline_loaded'
+            if use_saved_timeline:
+                timeline = load_timeline(key)
+            if timeline is None:
+                if not build:
+                    return None
+                how = 'timeline_built'
+                timeline = build_timeline(key)
+                if save and use_saved_timeline:
+                    save_timeline(timeline)
+        timeline_gets.inc(how)
+        if count is not None:
+            count(how)
+        return timeline
+
+
+# Forget the timeline, and don't use the saved one any more.  Needed if
+# schema_remarks is changed in this process (see 'schema-tool
+# generate'), as the timeline includes remarks from it.
+
+
+def clear_cache():
+    global timeline, use_saved_timeline
+    with timeline_lock:
+        timeline = None
+        use_saved_timeline = False
+    get_schema.clear_cache()
+
+
+# 4. Slicing a versioned schema out of the timeline.
+#
+# Given a Bugzilla version range, versioned_tables() returns a triple
+# (bzs, errors, tables).  'bzs' is the list of Bugzilla versions in
+# which the schema changes, starting with 'first', and 'errors' is the
+# list of errors found when reducing those schemas.  'tables' is the
+# pivoted versioned schema (see make_schema_doc.pivot_schemas()), with
+# presence bitmasks referring to 'bzs'.  The pair lists only have an
+# entry for each change, rather than for every version, which makes no
+# difference to the schema document.  Tables, columns and indexes are
+# in the same order as they would be if the schemas were pivoted.
+
+
+# Return the names from the orders at positions p0 to p1, in order of
+# first appearance.
+
+
+def range_order(orders, p0, p1):
+    names = {}
+    previous = None
+    for order in orders[p0 : p1 + 1]:
+        if order is None or order is previous:
+            continue
+        for name in order:
+            names[name] = True
+        previous = order
+    return names.keys()
+
+
+def slice_histories(histories, orders, in_range, p0, p1, bzs):
+    records = {}
+    for name in range_order(orders, p0, p1):
+        history = histories[name]
+        versions = history.versions & in_range
+        first_present = (versions & -versions).bit_length() - 1
+        record = {'versions': versions >> p0, 'Remarks': list(history.Remarks)}
+        for k, changes in history.changes.items():
+            pl = []
+            for (pos, value) in changes:
+                if pos <= first_present:
+                    pl = [(bzs[first_present - p0], value)]
+                elif pos <= p1:
+                    pl.append((bzs[pos - p0], value))
+                else:
+                    break
+            record[k] = pl
+        records[name] = record
+    return records
+
+
+def versioned_tables(timeline, first, last):
+    p0 = timeline.positions[first]
+    p1 = timeline.positions[last]
+    bzs = [first] + list(timeline.versions[p0 + 1 : p1 + 1])
+    errors = [
+        e for schema_errors in timeline.errors[p0 : p1 + 1] for e in schema_errors
+    ]
+    in_range = (1 << (p1 + 1)) - (1 << p0)
+    tables = {}
+    for t in range_order(timeline.table_orders, p0, p1):
+        history = timeline.tables[t]
+        tables[t] = [
+            (history.versions & in_range) >> p0,
+            slice_histories(
+                history.columns, history.column_orders, in_range, p0, p1, bzs
+            ),
+            slice_histories(
+                history.indexes, history.index_orders, in_range, p0, p1, bzs
+            ),
+        ]
+    return (bzs, errors, tables)
+
+
+# A. REFERENCES
+#
+# [Python] "marshal -- Internal Python object serialization"; Python
+# Software Foundation; <https://docs.python.org/3/library/marshal.html>.
+#
+#
+# B. DOCUMENT HISTORY
+#
+# 2026-10-18 AG  Created.
+#
+#
+# C. COPYRIGHT AND LICENSE
+#
+# This file is copyright (c) 2026 Bugzilla Project Contributors. All rights
+# reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# 1.  Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+# 2.  Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDERS AND CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+#
+# $Id$
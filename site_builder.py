@@ -0,0 +1,469 @@
+#             Perforce Defect Tracking Integration Project
+#              <http://www.ravenbrook.com/project/p4dti/>
+#
+#        SITE_BUILDER.PY -- GENERATE A STATIC SITE OF SCHEMA DOCUMENTS
+#
+#
+# 1. INTRODUCTION
+#
+# This module generates schema documents for many versions and version
+# ranges at once, and writes them into a directory from which they can
+# be served as static files, so that no Python has to run to serve
+# them.  It is used by 'schema-tool build-site'.
+#
+# The documents are generated in parallel by a pool of worker
+# processes.  Each document is written to a temporary file and then
+# renamed into place, so a web server never serves part of a document.
+# When all the documents have been generated, an index page and a
+# manifest are written.  The manifest, 'manifest.json', lists every
+# page with its versions, size and SHA-256 hash, and every page which
+# could not be generated with its errors.
+#
+# The manifest also records the inputs of each page (see section 3),
+# with a hash of each.  When the site is built again, a page whose
+# inputs have not changed is not generated again, so after an edit to
+# one remark only the pages which use it are generated.
+#
+# The same pages can be checked without building a site (see section
+# 6), which is what 'schema-tool test --all' does.
+#
+# The intended readership is project developers.
+#
+# This document is not confidential.
+
+import concurrent.futures
+import functools
+import hashlib
+import html
+import json
+import os
+import tempfile
+import time
+
+import get_schema
+import make_schema_doc
+import lazy_remarks as schema_remarks
+import page_cache
+import schema_store
+import schema_timeline
+
+# 2. The pages of the site.
+#
+# The site has a page for every Bugzilla version, 'single/VERSION.html',
+# and a page for each of a set of version ranges,
+# 'range/FIRST_LAST.html'.  The ranges are chosen by name:
+#
+# none:      no range pages;
+# adjacent:  each version and the one after it;
+# all:       every pair of versions.
+
+MANIFEST_FILE = 'manifest.json'
+INDEX_FILE = 'index.html'
+
+range_choices = ['none', 'adjacent', 'all']
+
+
+def page_path(first, last):
+    if first == last:
+        return 'single/%s.html' % first
+    return 'range/%s_%s.html' % (first, last)
+
+
+def site_pages(ranges):
+    versions = [
+        v
+        for v in schema_remarks.version_order
+        if v in schema_remarks.version_schema_map
+    ]
+    pages = [(v, v) for v in versions]
+    if ranges == 'adjacent':
+        pages.extend(zip(versions, versions[1:]))
+    elif ranges == 'all':
+        for (i, first) in enumerate(versions):
+            for last in versions[i + 1 :]:
+                pages.append((first, last))
+    return pages
+
+
+# 3. The inputs of a page.
+#
+# The inputs of a page are the ones recorded in its RenderContext (see
+# make_schema_doc.py), and the code which generates it, which is the
+# input ('code', None): the same files as for the response cache of
+# the web interface (see page_cache.code_paths()).  The hash of an
+# input is a SHA-256 hash of its contents.  The contents of a schema
+# are the ones get_schema.py reads: the tables decoded from the schema
+# store if it is there, and the pickle otherwise.  The hash of a
+# schema_remarks variable or entry is the hash of its repr().  The hash
+# of a set of inputs is the hash of all their hashes.  The hashes are
+# only worked out once per build.
+#
+# A page uses a couple of thousand inputs, but many pages use the same
+# set of inputs, so the manifest has a list of the different sets,
+# 'input_sets', and each page has the number of its set, 'inputs', and
+# the hash of the set when the page was generated, 'inputs_hash'.  In
+# the manifest, a set is packed into a list of pairs [names, keys],
+# each standing for every input (name, key) with the name in 'names'
+# and the key in 'keys'.
+
+
+def hash_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def schema_hash(name):
+    store = schema_store.get_store()
+    if store is not None and store.has_schema(name):
+        h = hashlib.sha256()
+        for (table, block) in store.tables(name).items():
+            h.update(repr((table, store.table(block))).encode('utf-8'))
+        return h.hexdigest()
+    try:
+        with open(get_schema.pickle_path(name), 'rb') as f:
+            return hash_bytes(f.read())
+    except OSError:
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def input_hash(name, key):
+    if name == 'code':
+        h = hashlib.sha256()
+        for path in page_cache.code_paths():
+            with open(path, 'rb') as f:
+                h.update(f.read())
+        return h.hexdigest()
+    if name == 'schema':
+        return schema_hash(key)
+    if name.startswith('keys:'):
+        value = getattr(schema_remarks, name[5:], None)
+        if isinstance(value, dict):
+            value = {
+                t: list(v.keys()) if isinstance(v, dict) else None
+                for (t, v) in value.items()
+            }
+    else:
+        value = getattr(schema_remarks, name, None)
+        if key is not None:
+            value = value.get(key) if isinstance(value, dict) else None
+    return hash_bytes(repr(value).encode('utf-8'))
+
+
+def inputs_hash(inputs):
+    h = hashlib.sha256()
+    for (name, key) in sorted(inputs, key=repr):
+        h.update(repr((name, key, input_hash(name, key))).encode('utf-8'))
+    return h.hexdigest()
+
+
+def pack_inputs(inputs):
+    keys = {}
+    for (name, key) in sorted(inputs, key=repr):
+        keys.setdefault(name, []).append(key)
+    groups = {}
+    for (name, name_keys) in keys.items():
+        groups.setdefault(tuple(name_keys), []).append(name)
+    return [[names, list(group_keys)] for (group_keys, names) in groups.items()]
+
+
+def unpack_inputs(packed):
+    return frozenset(
+        (name, key) for (names, keys) in packed for name in names for key in keys
+    )
+
+
+# The input sets of a build: the list of sets, the number of each set,
+# and the current hash of each set.
+
+
+class InputSets:
+    def __init__(self):
+        self.sets = []
+        self.numbers = {}
+        self.hashes = []
+
+    def add(self, inputs):
+        if inputs not in self.numbers:
+            self.numbers[inputs] = len(self.sets)
+            self.sets.append(inputs)
+            self.hashes.append(inputs_hash(inputs))
+        return self.numbers[inputs]
+
+    def packed(self):
+        return [pack_inputs(inputs) for inputs in self.sets]
+
+
+# 4. Writing files.
+
+
+# Write data to a file in the site, replacing it atomically.
+
+
+def write_atomically(directory, path, data):
+    path = os.path.join(directory, path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    (fd, temp) = tempfile.mkstemp(
+        dir=os.path.dirname(path), prefix='.' + os.path.basename(path)
+    )
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+# Generate and write the page for a version range.  This runs in a
+# worker process.  Returns a pair (entry, inputs): the manifest entry
+# for the page, which has an 'errors' list instead of a 'sha256' if it
+# could not be generated or written for any reason (as in check_page()
+# below), and the set of its inputs.
+
+
+def build_page(directory, first, last):
+    path = page_path(first, last)
+    entry = {'path': path, 'first': first, 'last': last}
+    ctx = make_schema_doc.RenderContext()
+    try:
+        (header, body, footer) = make_schema_doc.make_tables(first, last, ctx=ctx)
+        document = (header + body + footer).encode('utf-8')
+        write_atomically(directory, path, document)
+    except make_schema_doc.BzSchemaProcessingException as e:
+        entry['errors'] = list(e.errors)
+        return (entry, None)
+    except Exception as e:  # pylint: disable=broad-except
+        entry['errors'] = ['%s: %s' % (type(e).__name__, e)]
+        return (entry, None)
+    entry['bytes'] = len(document)
+    entry['sha256'] = hash_bytes(document)
+    inputs = frozenset(ctx.inputs.keys()) | {('code', None)}
+    return (entry, inputs)
+
+
+# Load the manifest from the last build, returning a map from path to
+# page entry and the list of input sets, or ({}, []) if there is no
+# usable manifest.
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILE), 'rb') as f:
+            manifest = json.load(f)
+        pages = {e['path']: e for e in manifest['pages']}
+        return (pages, [unpack_inputs(packed) for packed in manifest['input_sets']])
+    except (OSError, ValueError, KeyError, TypeError):
+        return ({}, [])
+
+
+# Return the input set of a page from the last build, if the page can be
+# used again: it was built, its file is still there, and its inputs have
+# not changed.
+
+
+def reusable_inputs(directory, old_pages, old_sets, input_sets, first, last):
+    entry = old_pages.get(page_path(first, last))
+    if entry is None or 'inputs_hash' not in entry:
+        return None
+    try:
+        if os.path.getsize(os.path.join(directory, entry['path'])) != entry['bytes']:
+            return None
+        inputs = old_sets[entry['inputs']]
+    except (OSError, IndexError, TypeError):
+        return None
+    if input_sets.hashes[input_sets.add(inputs)] != entry['inputs_hash']:
+        return None
+    return inputs
+
+
+def index_page(pages):
+    lines = [
+        '<!DOCTYPE html>',
+        '<html lang="en">',
+        '<head><meta charset="utf-8" />'
+        '<title>Bugzilla Schema Documentation</title></head>',
+        '<body>',
+        '<h1>Bugzilla Schema Documentation</h1>',
+    ]
+    for (title, kind) in [('Single versions', 'single'), ('Version ranges', 'range')]:
+        entries = [p for p in pages if p['path'].startswith(kind + '/')]
+        if not entries:
+            continue
+        lines.append('<h2>%s</h2>' % title)
+        lines.append('<ul>')
+        for p in entries:
+            if p['first'] == p['last']:
+                text = p['first']
+            else:
+                text = '%s to %s' % (p['first'], p['last'])
+            lines.append(
+                '<li><a href="%s">%s</a></li>'
+                % (html.escape(p['path']), html.escape(text))
+            )
+        lines.append('</ul>')
+    lines.append('</body>')
+    lines.append('</html>')
+    return (str.join('\n', lines) + '\n').encode('utf-8')
+
+
+# 5. Building the site.
+#
+# build_site() generates the pages with 'jobs' worker processes (by
+# default, one for each CPU), calling progress(entry) as each page is
+# done, and returns the manifest.  Unless 'force' is true, pages from
+# the last build whose inputs have not changed are kept; the manifest
+# has the number of them in 'reused'.  The schema timeline is built
+# (and saved) before the workers start, so that they can all load it
+# instead of each building it.  A page which fails, even because its
+# worker does, is reported in the manifest's 'failed' list, and the
+# manifest is always written, so that the next build only has to make
+# the pages which failed or have changed.
+
+
+def build_site(directory, ranges='adjacent', jobs=None, progress=None, force=False):
+    directory = os.path.abspath(directory)
+    os.makedirs(directory, exist_ok=True)
+    input_hash.cache_clear()
+    if force:
+        (old_pages, old_sets) = ({}, [])
+    else:
+        (old_pages, old_sets) = load_manifest(directory)
+    input_sets = InputSets()
+    pages = site_pages(ranges)
+    entries = {}
+    todo = []
+    for (first, last) in pages:
+        inputs = reusable_inputs(
+            directory, old_pages, old_sets, input_sets, first, last
+        )
+        if inputs is None:
+            todo.append((first, last))
+        else:
+            entry = dict(old_pages[page_path(first, last)])
+            entry['inputs'] = input_sets.add(inputs)
+            entries[entry['path']] = entry
+    if todo:
+        schema_timeline.get_timeline(save=True)
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(build_page, directory, first, last): (first, last)
+            for (first, last) in todo
+        }
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                (entry, inputs) = future.result()
+            except Exception as e:  # pylint: disable=broad-except
+                (first, last) = futures[future]
+                entry = {'path': page_path(first, last), 'first': first, 'last': last}
+                entry['errors'] = ['%s: %s' % (type(e).__name__, e)]
+                inputs = None
+            if inputs is not None:
+                entry['inputs'] = input_sets.add(inputs)
+                entry['inputs_hash'] = input_sets.hashes[entry['inputs']]
+            entries[entry['path']] = entry
+            if progress is not None:
+                progress(entry)
+    ordered = [entries[page_path(first, last)] for (first, last) in pages]
+    built = [e for e in ordered if 'errors' not in e]
+    manifest = {
+        'generated': time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+        'remarks_id': make_schema_doc.strip_p4_id(schema_remarks.remarks_id),
+        'ranges': ranges,
+        'reused': len(pages) - len(todo),
+        'pages': built,
+        'failed': [e for e in ordered if 'errors' in e],
+        'input_sets': input_sets.packed(),
+    }
+    write_atomically(directory, INDEX_FILE, index_page(built))
+    write_atomically(
+        directory, MANIFEST_FILE, (json.dumps(manifest) + '\n').encode('utf-8')
+    )
+    return manifest
+
+
+# 6. Checking every page.
+#
+# check_pages() generates the documents for every version and for the
+# version ranges chosen by 'ranges' (see section 2), in 'jobs' worker
+# processes, without writing them anywhere, and returns a map from
+# (first, last) to the list of errors for each document which has any.
+# It calls progress(first, last, errors) as each document is checked.
+#
+# As when building the site, the schema timeline is built (and saved)
+# before the workers start, so the reduced schemas are shared by all
+# the workers rather than read and reduced again by each of them.  A
+# document which can't be generated for any reason is reported, not
+# just one whose schemas or remarks have errors, so that a remark with
+# a bad cross-reference is found too.
+
+
+def check_page(first, last):
+    try:
+        make_schema_doc.make_tables(first, last)
+    except make_schema_doc.BzSchemaProcessingException as e:
+        return list(e.errors)
+    except Exception as e:  # pylint: disable=broad-except
+        return ['%s: %s' % (type(e).__name__, e)]
+    return []
+
+
+def check_pages(ranges='none', jobs=None, progress=None):
+    pages = site_pages(ranges)
+    schema_timeline.get_timeline(save=True)
+    failed = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {
+            executor.submit(check_page, first, last): (first, last)
+            for (first, last) in pages
+        }
+        for future in concurrent.futures.as_completed(futures):
+            (first, last) = futures[future]
+            errors = future.result()
+            if errors:
+                failed[(first, last)] = errors
+            if progress is not None:
+                progress(first, last, errors)
+    return {page: failed[page] for page in pages if page in failed}
+
+
+# A. REFERENCES
+#
+#
+# B. DOCUMENT HISTORY
+#
+# 2026-10-18 AG  Created.
+#
+#
+# C. COPYRIGHT AND LICENSE
+#
+# This file is copyright (c) 2026 Bugzilla Project Contributors. All rights
+# reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+# 1.  Redistributions of source code must retain the above copyright
+#     notice, this list of conditions and the following disclaimer.
+#
+# 2.  Redistributions in binary form must reproduce the above copyright
+#     notice, this list of conditions and the following disclaimer in
+#     the documentation and/or other materials provided with the
+#     distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# HOLDERS AND CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT,
+# INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING,
+# BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS
+# OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND
+# ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR
+# TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE
+# USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH
+# DAMAGE.
+#
+#
+# $Id$